@@ -0,0 +1,112 @@
+import math
+import random
+import sys
+import time
+
+import test as bot
+
+SIZES = [7, 15, 30, 50, 100, 150, 200]
+REPEATS = 3
+
+
+#################################################################################
+# The pure-Python Floyd-Warshall + eager path cache that init() used to run, kept as the reference
+class LegacyMinFactoryDistances:
+    def __init__(self, num_factories):
+        self.__min_distances = [[(math.inf if m != n else 0) for n in range(num_factories)] for m in range(num_factories)]
+        self.__predecessors = [[-1 for n in range(num_factories)] for m in range(num_factories)]
+        self.__num_factories = num_factories
+        self.__cached_paths = {}    # (u,v) -> [path]
+
+    def create_edge(self, u, v, dist):
+        self.__min_distances[u][v] = dist
+        self.__predecessors[u][v] = u   # identity
+
+    def get_distance(self, u, v):
+        return self.__min_distances[u][v]
+
+    def calculate(self):
+        for k in range(self.__num_factories):
+            for u in range(self.__num_factories):
+                for v in range(self.__num_factories):
+                    if self.__min_distances[u][v] > (self.__min_distances[u][k] + self.__min_distances[k][v]):
+                        self.__min_distances[u][v] = self.__min_distances[u][k] + self.__min_distances[k][v]
+                        self.__predecessors[u][v] = self.__predecessors[k][v]
+
+    def __get_path(self, u, v):
+        path = []
+        k = v
+        while k != -1:
+            path.append(k)
+            k = self.__predecessors[u][k]
+        return path[::-1]
+
+    def cache_all_paths(self):
+        for u in range(self.__num_factories):
+            for v in range(self.__num_factories):
+                self.__cached_paths[(u, v)] = self.__get_path(u, v)
+
+    def get_cached_path(self, u, v):
+        return self.__cached_paths[(u, v)]
+
+
+# Complete graph with arena-like distances
+def generate_links(num_factories, seed):
+    rand = random.Random(seed)
+    return [(u, v, rand.randint(1, 20)) for u in range(num_factories) for v in range(u + 1, num_factories)]
+
+
+def startup(cls, num_factories, links):
+    distances = cls(num_factories)
+    for u, v, dist in links:
+        distances.create_edge(u, v, dist)
+        distances.create_edge(v, u, dist)
+    distances.calculate()
+    if hasattr(distances, "cache_all_paths"):
+        distances.cache_all_paths()
+    return distances
+
+
+def best_time(cls, num_factories, links):
+    best = math.inf
+    result = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = startup(cls, num_factories, links)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000.0, result
+
+
+def check_same(legacy, engine, num_factories):
+    for u in range(num_factories):
+        for v in range(num_factories):
+            if legacy.get_distance(u, v) != engine.get_distance(u, v):
+                raise AssertionError("Distance mismatch at ({}, {})".format(u, v))
+            path = engine.get_cached_path(u, v)
+            length = sum(engine.get_distance(path[k-1], path[k]) for k in range(1, len(path)))
+            if path[0] != u or path[-1] != v or length != engine.get_distance(u, v):
+                raise AssertionError("Bad path {} for ({}, {})".format(path, u, v))
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or SIZES
+    print("{:>5} {:>12} {:>12} {:>14} {:>9}".format("F", "legacy ms", "numpy ms", "+all paths ms", "speedup"))
+    for num_factories in sizes:
+        links = generate_links(num_factories, seed=num_factories)
+        legacy_ms, legacy = best_time(LegacyMinFactoryDistances, num_factories, links)
+        engine_ms, engine = best_time(bot.MinFactoryDistances, num_factories, links)
+
+        # Cost of materializing every path lazily, which a real game never does
+        start = time.perf_counter()
+        for u in range(num_factories):
+            for v in range(num_factories):
+                engine.get_cached_path(u, v)
+        paths_ms = (time.perf_counter() - start) * 1000.0
+        check_same(legacy, engine, num_factories)
+
+        print("{:>5} {:>12.2f} {:>12.2f} {:>14.2f} {:>8.1f}x".format(num_factories, legacy_ms, engine_ms,
+                                                                     paths_ms, legacy_ms / engine_ms))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+import argparse
+import contextlib
+import io
+import math
+import random
+import time
+import tracemalloc
+
+import numpy as np
+
+import test as bot
+
+DEFAULT_SIZES = [7, 15, 31, 63, 125, 250, 500]
+DEFAULT_ENTITIES = [100, 300, 1000, 3000]
+DEFAULT_TROOPS = 1000       # In flight during the factory sweep
+ENTITY_SWEEP_FACTORIES = 63
+BOMB_FRACTION = 0.05        # Of the generated entities that are not factories
+SPARSE_DEGREE = 3           # Nearest neighbors linked per factory on sparse maps
+INIT_PHASES = ["parse_init", "distances", "graph"]
+TURN_PHASES = ["parse", "perception", "dispatch", "targets", "search", "bombs", "turn"]
+
+
+#################################################################################
+# Telemetry that keeps every span's time, summed over the run
+class PhaseTelemetry(bot.Telemetry):
+    def __init__(self):
+        bot.Telemetry.__init__(self, "-")
+        self.phases = {}    # name -> total ms
+
+    def add_time(self, name, ms):
+        bot.Telemetry.add_time(self, name, ms)
+        self.phases[name] = self.phases.get(name, 0.0) + ms
+
+
+#################################################################################
+# Peak traced memory above the level at span entry, nested spans count towards their parents
+class MemoryTelemetry(bot.Telemetry):
+    def __init__(self):
+        bot.Telemetry.__init__(self)
+        self.enabled = True
+        self.peaks = {}     # name -> KiB
+        self.__stack = []   # [name, base, peak] per open span
+
+    @contextlib.contextmanager
+    def span(self, name):
+        if self.__stack:
+            self.__stack[-1][2] = max(self.__stack[-1][2], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        self.__stack.append([name, base, base])
+        try:
+            yield
+        finally:
+            _, base, peak = self.__stack.pop()
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            self.peaks[name] = max(self.peaks.get(name, 0.0), (peak - base) / 1024.0)
+            if self.__stack:
+                self.__stack[-1][2] = max(self.__stack[-1][2], peak)
+
+    def end_turn(self, **counters):
+        pass
+
+
+# Factories on a plane, link lengths scaled so the map is as wide as the arena's longest link.
+# Dense maps link every pair like the arena does, sparse ones only the nearest few plus a tree that keeps them connected.
+def generate_map(num_factories, dense, seed):
+    rand = random.Random(seed)
+    points = np.array([(rand.random(), rand.random()) for _ in range(num_factories)])
+    lengths = np.hypot(*(points[:, np.newaxis, :] - points[np.newaxis, :, :]).transpose(2, 0, 1))
+    lengths = np.maximum(1, np.rint(lengths * bot.MAX_DISTANCE / math.sqrt(2))).astype(np.int32)
+
+    if dense:
+        pairs = {(u, v) for u in range(num_factories) for v in range(u + 1, num_factories)}
+    else:
+        pairs = set()
+        order = np.argsort(lengths, axis=1)
+        for u in range(num_factories):
+            for v in order[u, 1:SPARSE_DEGREE + 1].tolist():
+                pairs.add((min(u, v), max(u, v)))
+            if u > 0:
+                v = int(np.argmin(lengths[u, :u]))
+                pairs.add((v, u))
+    return np.array(sorted((u, v, lengths[u, v]) for u, v in pairs), dtype=np.int32).reshape(-1, 3)
+
+
+# One turn's entity rows: every factory, then troops and bombs between random factories, still on their way
+def generate_entities(num_factories, distances, num_entities, seed):
+    rand = random.Random(seed)
+    rows = []
+    for f in range(num_factories):
+        owner = rand.choice([bot.PLAYER_ID_SELF, bot.PLAYER_ID_NEUTRAL, bot.PLAYER_ID_OPPONENT])
+        rate = rand.randint(0, bot.MAX_RATE)
+        rows.append((f, bot.ENTITY_FACTORY, owner, rand.randint(0, 10 * (rate + 1)), rate, 0, 0))
+    num_bombs = int(num_entities * BOMB_FRACTION)
+    for k in range(num_entities):
+        src, dst = rand.sample(range(num_factories), 2)
+        owner = rand.choice([bot.PLAYER_ID_SELF, bot.PLAYER_ID_OPPONENT])
+        time_left = rand.randint(1, int(distances[src, dst]))
+        if k < num_bombs:
+            rows.append((num_factories + k, bot.ENTITY_BOMB, owner, src, dst, time_left, 0))
+        else:
+            rows.append((num_factories + k, bot.ENTITY_TROOP, owner, src, dst, rand.randint(1, 20), time_left))
+    return rows
+
+
+def encode_init(num_factories, links):
+    lines = [str(num_factories), str(len(links))] + [" ".join(map(str, link)) for link in links.tolist()]
+    return ("\n".join(lines) + "\n").encode()
+
+
+def encode_turn(rows):
+    lines = [str(len(rows))] + ["{} {} {} {} {} {} {}".format(*row) for row in rows]
+    return ("\n".join(lines) + "\n").encode()
+
+
+# Init plus a few independent turns on one map, every phase timed in one pass and traced in another
+def run_map(num_factories, dense, num_entities, turns, seed, trace=True):
+    links = generate_map(num_factories, dense, seed)
+    init_block = encode_init(num_factories, links)
+    distances = None
+    turn_blocks = []
+
+    result = {"factories": num_factories, "entities": num_entities, "links": len(links),
+              "ms": {}, "kib": {}}
+    telemetry = bot.telemetry
+    for traced in (False, True) if trace else (False,):
+        bot.telemetry = MemoryTelemetry() if traced else PhaseTelemetry()
+        if traced:
+            tracemalloc.start()
+        with contextlib.redirect_stderr(io.StringIO()):
+            with bot.telemetry.span("parse_init"):
+                reader = bot.InputReader(io.BytesIO(init_block))
+                factory_count = reader.read_int()
+                map_links = reader.read_table(reader.read_int(), 3)
+            state, msg_generator = bot.init_state(factory_count, map_links, seed, bot.Params())
+            if distances is None:
+                distances = state.min_distances.distances
+                turn_blocks = [encode_turn(generate_entities(num_factories, distances, num_entities, seed + k))
+                               for k in range(turns)]
+            for turn_block in turn_blocks:
+                bot.telemetry.start_turn()
+                with bot.telemetry.span("turn"):
+                    with bot.telemetry.span("parse"):
+                        bot.read_turn(state, bot.InputReader(io.BytesIO(turn_block)))
+                    bot.play_turn(state, msg_generator)
+                bot.telemetry.end_turn()
+        if traced:
+            tracemalloc.stop()
+            result["kib"] = dict(bot.telemetry.peaks)
+        else:
+            result["ms"] = {name: ms / (1 if name in INIT_PHASES else turns)
+                            for name, ms in bot.telemetry.phases.items()}
+    bot.telemetry = telemetry
+    return result
+
+
+# Exponent of ms ~ n^k fitted over the larger half of a sweep, where fixed costs no longer dominate
+def scaling_exponent(sizes, values):
+    points = [(n, v) for n, v in zip(sizes, values) if v > 0][len(sizes) // 2 - 1:]
+    if len(points) < 2:
+        return math.nan
+    n, v = np.log(np.array(points, dtype=float)).T
+    return float(np.polyfit(n, v, 1)[0])
+
+
+def print_sweep(title, key, results, phases):
+    print("\n{}".format(title))
+    print("{:>6} {:>7} {:>7}  ".format("F", "links", "ents") + " ".join("{:>11}".format(p) for p in phases))
+    for r in results:
+        print("{:>6} {:>7} {:>7}  ".format(r["factories"], r["links"], r["entities"]) +
+              " ".join("{:>11.3f}".format(r["ms"].get(p, 0.0)) for p in phases) + "  ms")
+        if r["kib"]:
+            print("{:>24}".format("") + " ".join("{:>11.1f}".format(r["kib"].get(p, 0.0)) for p in phases) + "  KiB")
+    sizes = [r[key] for r in results]
+    slopes = [scaling_exponent(sizes, [r["ms"].get(p, 0.0) for r in results]) for p in phases]
+    print("{:>24}".format("n^k, k =") + " ".join("{:>11.2f}".format(k) for k in slopes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time and peak memory of init and every turn phase on synthetic "
+                                                 "maps, swept over factory and entity counts")
+    parser.add_argument("--sizes", type=int, nargs="*", default=DEFAULT_SIZES)
+    parser.add_argument("--entities", type=int, nargs="*", default=DEFAULT_ENTITIES)
+    parser.add_argument("--troops", type=int, default=DEFAULT_TROOPS, help="entities during the factory sweep")
+    parser.add_argument("--entity-factories", type=int, default=ENTITY_SWEEP_FACTORIES,
+                        help="factories during the entity sweep")
+    parser.add_argument("--sparse", action="store_true", help="link each factory to its nearest few only")
+    parser.add_argument("--turns", type=int, default=3, help="turns timed per map")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-trace", action="store_true", help="skip the tracemalloc pass")
+    args = parser.parse_args()
+
+    dense = not args.sparse
+    start = time.perf_counter()
+    by_factories = [run_map(n, dense, args.troops, args.turns, args.seed, not args.no_trace) for n in args.sizes]
+    by_entities = [run_map(args.entity_factories, dense, n, args.turns, args.seed, not args.no_trace)
+                   for n in args.entities]
+
+    density = "dense" if dense else "sparse"
+    print_sweep("{} maps, {} entities, by factories".format(density, args.troops), "factories", by_factories,
+                INIT_PHASES + TURN_PHASES)
+    print_sweep("{} maps, {} factories, by entities".format(density, args.entity_factories), "entities",
+                by_entities, TURN_PHASES)
+    print("\n{:.1f} s".format(time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
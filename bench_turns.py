@@ -0,0 +1,184 @@
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import referee
+import test as bot
+
+DEFAULT_SIZES = [7, 11, 15]
+DEFAULT_GAMES = 4
+ENTITY_BUCKETS = [0, 25, 50, 100, 200, 400]
+PERCENTILES = [50, 95, 99]
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+
+#################################################################################
+# A recorded or generated game: the init block and the turn blocks seen by one player
+class TurnInputs:
+    def __init__(self, label, seed, init_block, turn_blocks):
+        self.label = label
+        self.seed = seed
+        self.init_block = init_block
+        self.turn_blocks = turn_blocks
+
+    @property
+    def num_factories(self):
+        return int(self.init_block.split(b"\n", 1)[0])
+
+
+# Self-play through the referee, keeping player 0's inputs
+def generate_inputs(seeds, sizes):
+    games = []
+    for num_factories in sizes:
+        for seed in seeds:
+            transcript = []
+            match = referee.Referee(seed, num_factories)
+            referee.play_match(seed, num_factories=num_factories, transcript=transcript)
+            turn_blocks = [turn_block for player, turn_block, command in transcript if player == 0]
+            games.append(TurnInputs("seed {} F={}".format(seed, num_factories), seed, match.init_block(), turn_blocks))
+    return games
+
+
+# Raw stdin capture of one game, exactly as the arena sends it
+def load_capture(path, seed=0):
+    with open(path, "rb") as capture:
+        lines = capture.read().splitlines(True)
+    link_count = int(lines[1])
+    init_block = b"".join(lines[:2 + link_count])
+    turn_blocks = []
+    k = 2 + link_count
+    while k < len(lines) and lines[k].strip():
+        entity_count = int(lines[k])
+        turn_blocks.append(b"".join(lines[k:k + 1 + entity_count]))
+        k += 1 + entity_count
+    return TurnInputs(os.path.basename(path), seed, init_block, turn_blocks)
+
+
+def bucket_of(entity_count):
+    lower = max(b for b in ENTITY_BUCKETS if b <= entity_count)
+    upper = min([b for b in ENTITY_BUCKETS if b > entity_count] or [None])
+    return "{}-{}".format(lower, upper - 1) if upper else "{}+".format(lower)
+
+
+# Feeds each turn through read_turn + play_turn, one timed pass and one traced pass
+def run_game(game, trace=True):
+    records = []
+    telemetry = bot.telemetry
+    for traced in (False, True) if trace else (False,):
+        if traced:
+            bot.telemetry = bot.Telemetry()     # Phase timings and profiles only come from the timed pass
+            tracemalloc.start()
+        with contextlib.redirect_stderr(io.StringIO()):
+            state, msg_generator = bot.init(bot.InputReader(io.BytesIO(game.init_block)), seed=game.seed,
+                                            params=bot.Params())    # Not a tuned params.json, baselines compare code
+            for k, turn_block in enumerate(game.turn_blocks):
+                reader = bot.InputReader(io.BytesIO(turn_block))
+                if traced:
+                    collections = sum(stat["collections"] for stat in gc.get_stats())
+                    tracemalloc.reset_peak()
+                    base, _ = tracemalloc.get_traced_memory()
+                    bot.read_turn(state, reader)
+                    bot.play_turn(state, msg_generator)
+                    _, peak = tracemalloc.get_traced_memory()
+                    records[k]["alloc_kib"] = (peak - base) / 1024.0
+                    records[k]["gc"] = sum(stat["collections"] for stat in gc.get_stats()) - collections
+                else:
+                    bot.telemetry.start_turn()
+                    state.path_costs.reset_stats()
+                    start = time.perf_counter()
+                    with bot.telemetry.span("parse"):
+                        bot.read_turn(state, reader)
+                    bot.play_turn(state, msg_generator)
+                    elapsed = time.perf_counter() - start
+                    bot.telemetry.end_turn(**bot.turn_counters(state))
+                    records.append({"factories": game.num_factories,
+                                    "entities": int(turn_block.split(b"\n", 1)[0]),
+                                    "ms": elapsed * 1000.0})
+        if traced:
+            tracemalloc.stop()
+            bot.telemetry = telemetry
+    return records
+
+
+def summarize(records):
+    groups = {}
+    for record in records:
+        groups.setdefault("F={:>3} entities {}".format(record["factories"], bucket_of(record["entities"])), []).append(record)
+        groups.setdefault("all", []).append(record)
+
+    summary = {}
+    for name, group in groups.items():
+        ms = np.array([r["ms"] for r in group])
+        summary[name] = {"turns": len(group), "max": float(ms.max()),
+                         "alloc_kib": float(np.mean([r.get("alloc_kib", 0.0) for r in group])),
+                         "gc": int(sum(r.get("gc", 0) for r in group))}
+        for p, value in zip(PERCENTILES, np.percentile(ms, PERCENTILES)):
+            summary[name]["p{}".format(p)] = float(value)
+    return summary
+
+
+def print_summary(summary, baseline=None, tolerance=0.25):
+    regressions = []
+    print("{:<28} {:>6} {:>8} {:>8} {:>8} {:>8} {:>10} {:>5}".format("group", "turns", "p50 ms", "p95 ms", "p99 ms",
+                                                                     "max ms", "alloc KiB", "gc"))
+    for name in sorted(summary, key=lambda n: (n == "all", n)):
+        row = summary[name]
+        flag = ""
+        if baseline and name in baseline and row["p95"] > baseline[name]["p95"] * (1.0 + tolerance):
+            flag = "  REGRESSION p95 {:.2f} -> {:.2f}".format(baseline[name]["p95"], row["p95"])
+            regressions.append(name)
+        print("{:<28} {:>6} {:>8.3f} {:>8.3f} {:>8.3f} {:>8.3f} {:>10.1f} {:>5}{}".format(
+            name, row["turns"], row["p50"], row["p95"], row["p99"], row["max"], row["alloc_kib"], row["gc"], flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-turn latency of the bot's decision step")
+    parser.add_argument("--games", type=int, default=DEFAULT_GAMES, help="generated games per map size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sizes", type=int, nargs="*", default=DEFAULT_SIZES)
+    parser.add_argument("--capture", nargs="*", default=[], help="raw stdin captures to replay instead")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative p95 slowdown")
+    parser.add_argument("--no-trace", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--telemetry", default=None, help="per-turn phase timings as JSONL, - for a summary only")
+    parser.add_argument("--profile", default=None, help="timed turns to run under cProfile, e.g. 10-20")
+    parser.add_argument("--profile-out", default=None, help="pstats dump instead of the top functions on stderr")
+    args = parser.parse_args()
+    bot.telemetry = bot.Telemetry(args.telemetry, args.profile, args.profile_out)
+
+    if args.capture:
+        games = [load_capture(path, args.seed) for path in args.capture]
+    else:
+        games = generate_inputs(range(args.seed, args.seed + args.games), args.sizes)
+
+    records = []
+    for game in games:
+        records += run_game(game, trace=not args.no_trace)
+    bot.telemetry.close()
+    summary = summarize(records)
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = print_summary(summary, baseline, args.tolerance)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+        print("Baseline saved to {}".format(args.baseline))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
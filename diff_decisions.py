@@ -0,0 +1,170 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+import bench_turns
+import replay
+import test as bot
+
+PERCENTILES = [50, 95]
+
+
+#################################################################################
+# One planner configuration, with its own state per game and its commands and timings per turn
+class Variant:
+    def __init__(self, name, params):
+        self.name = name
+        self.params = params
+        self.commands = []      # per game, list of commands per turn
+        self.ms = []            # per game, list of ms per turn
+
+    # "name:spec" or "spec", spec is "defaults", a Params JSON file or key=value overrides separated by commas
+    @classmethod
+    def parse(cls, text):
+        name, _, spec = text.rpartition(":") if ":" in text and not os.path.exists(text) else ("", "", text)
+        if spec == "defaults":
+            params = bot.Params()
+        elif os.path.exists(spec):
+            params = bot.Params.load(spec)
+        else:
+            values = bot.Params().to_dict()
+            for override in spec.split(","):
+                key, _, value = override.partition("=")
+                if key not in values:
+                    raise ValueError("Unknown parameter {} in {}".format(key, text))
+                values[key] = json.loads(value)
+            params = bot.Params.from_dict(values)
+        return cls(name or spec, params)
+
+
+#################################################################################
+# Links and entity rows of every turn, decoded once and fed to every variant
+class DecodedGame:
+    def __init__(self, label, seed, num_factories, links, turns):
+        self.label = label
+        self.seed = seed
+        self.num_factories = num_factories
+        self.links = links
+        self.turns = turns      # (entities, 7) arrays, as read_entities returns them
+
+    @classmethod
+    def from_inputs(cls, game):
+        reader = bot.InputReader(io.BytesIO(game.init_block))
+        num_factories = reader.read_int()
+        links = reader.read_table(reader.read_int(), 3)
+        turns = [bot.InputReader(io.BytesIO(block)).read_entities() for block in game.turn_blocks]
+        return cls(game.label, game.seed, num_factories, links, turns)
+
+    @classmethod
+    def from_replay(cls, game, m, seed):
+        return cls("game {}".format(m), seed, game.num_factories, game.links, [e for e, _ in game.turns()])
+
+
+# Action parts of a command, the taunt message and the order of the actions never change the game
+def actions(command):
+    return sorted(part.strip() for part in command.split(";") if not part.strip().startswith(bot.CMD_MSG))
+
+
+# Every variant replays the same decoded turns, the first one builds the map structures the others share
+def run_game(game, variants, budget_ms=None):
+    states = []
+    with contextlib.redirect_stderr(io.StringIO()):
+        for variant in variants:
+            if states:
+                state = bot.GameState(game.num_factories, variant.params)
+                state.share_topology(states[0][0])
+                msg_generator = bot.MessageGenerator(seed=game.seed)
+            else:
+                state, msg_generator = bot.init_state(game.num_factories, game.links, game.seed, variant.params)
+            states.append((state, msg_generator))
+            variant.commands.append([])
+            variant.ms.append([])
+
+        for k, entities in enumerate(game.turns):
+            for variant, (state, msg_generator) in zip(variants, states):
+                turn_timer = bot.timer.start()
+                deadline = bot.Deadline()
+                if budget_ms is not None:
+                    deadline = bot.Deadline(turn_timer, bot.FIRST_TURN_BUDGET_MS if k == 0 else budget_ms)
+                bot.load_turn(state, entities)
+                command = bot.play_turn(state, msg_generator, deadline)
+                variant.ms[-1].append(bot.timer.stop(turn_timer))
+                variant.commands[-1].append(command)
+
+
+def print_report(games, variants, show):
+    base = variants[0]
+    print("{:<20} {:>8} {:>8} {:>9} {:>9} {:>9} {:>9}".format("variant", "diffs", "turns", "p50 ms", "p95 ms",
+                                                            "d p50 ms", "d p95 ms"))
+    base_ms = np.concatenate([np.array(ms) for ms in base.ms]) if base.ms else np.zeros(0)
+    base_p = np.percentile(base_ms, PERCENTILES) if len(base_ms) else [0.0, 0.0]
+    for variant in variants:
+        ms = np.concatenate([np.array(m) for m in variant.ms]) if variant.ms else np.zeros(0)
+        p = np.percentile(ms, PERCENTILES) if len(ms) else [0.0, 0.0]
+        diffs = sum(actions(a) != actions(b) for game_a, game_b in zip(base.commands, variant.commands)
+                    for a, b in zip(game_a, game_b))
+        print("{:<20} {:>8} {:>8} {:>9.3f} {:>9.3f} {:>+9.3f} {:>+9.3f}".format(
+            variant.name[:20], diffs, len(ms), p[0], p[1], p[0] - base_p[0], p[1] - base_p[1]))
+
+    for variant in variants[1:]:
+        shown = 0
+        for m, game in enumerate(games):
+            for k, (a, b) in enumerate(zip(base.commands[m], variant.commands[m])):
+                if shown >= show or actions(a) == actions(b):
+                    continue
+                if shown == 0:
+                    print("\n{} vs {}".format(base.name, variant.name))
+                shown += 1
+                print("{} turn {} ({:+.2f} ms)".format(game.label, k, variant.ms[m][k] - base.ms[m][k]))
+                print("  - {}".format(";".join(actions(a)) or bot.CMD_WAIT))
+                print("  + {}".format(";".join(actions(b)) or bot.CMD_WAIT))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the same turn inputs through several planner configurations "
+                                                 "and report where their commands and timings differ")
+    parser.add_argument("variants", nargs="+", help="[name:]defaults, a Params JSON file or key=value,... overrides, "
+                                                    "the first one is the baseline")
+    parser.add_argument("--replay", default=None, help="binary replay file to read the turns from")
+    parser.add_argument("--capture", nargs="*", default=[], help="raw stdin captures to read the turns from")
+    parser.add_argument("--games", type=int, default=bench_turns.DEFAULT_GAMES, help="generated games per map size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sizes", type=int, nargs="*", default=bench_turns.DEFAULT_SIZES)
+    parser.add_argument("--budget-ms", type=float, default=None,
+                        help="turn budget to plan under, unlimited by default so only the parameters differ")
+    parser.add_argument("--show", type=int, default=10, help="differing turns to print per variant")
+    args = parser.parse_args()
+
+    variants = [Variant.parse(text) for text in args.variants]
+    if len(variants) == 1:
+        variants.insert(0, Variant("defaults", bot.Params()))
+
+    replays = None
+    if args.replay:
+        replays = replay.ReplayReader(args.replay)
+        games = [DecodedGame.from_replay(game, m, args.seed) for m, game in enumerate(replays)]
+    elif args.capture:
+        games = [DecodedGame.from_inputs(bench_turns.load_capture(path, args.seed)) for path in args.capture]
+    else:
+        generated = bench_turns.generate_inputs(range(args.seed, args.seed + args.games), args.sizes)
+        games = [DecodedGame.from_inputs(game) for game in generated]
+
+    start = time.perf_counter()
+    for game in games:
+        run_game(game, variants, args.budget_ms)
+    print("{} games, {} turns, {} variants in {:.1f} s".format(len(games), sum(len(g.turns) for g in games),
+                                                              len(variants), time.perf_counter() - start),
+          file=sys.stderr)
+    print_report(games, variants, args.show)
+    if replays is not None:
+        replays.close()
+
+
+if __name__ == "__main__":
+    main()
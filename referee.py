@@ -0,0 +1,428 @@
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import math
+import multiprocessing
+import os
+import random
+import select
+import subprocess
+import sys
+import tempfile
+
+BOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test.py")
+
+MAP_WIDTH = 16000
+MAP_HEIGHT = 6500
+FACTORY_RADIUS = 700
+DISTANCE_SCALE = 800
+MAX_DISTANCE = 20
+MIN_FACTORIES = 7
+MAX_FACTORIES = 15
+MAX_TURNS = 200
+MAX_BOMBS = 2
+MAX_PRODUCTION = 3
+INC_COST = 10
+BOMB_DISABLE_TURNS = 5
+BOMB_MIN_DAMAGE = 10
+PIPE_TIMEOUT_S = 10.0   # Far beyond any turn budget, a bot this late never flushed its command
+
+NEUTRAL = -1    # Owners are player indexes 0 and 1 inside the referee
+
+
+#################################################################################
+class Factory:
+    __slots__ = ("id", "owner", "num_cyborgs", "production", "disabled", "x", "y")
+
+    def __init__(self, factory_id, x, y, production, num_cyborgs=0, owner=NEUTRAL):
+        self.id = factory_id
+        self.owner = owner
+        self.num_cyborgs = num_cyborgs
+        self.production = production
+        self.disabled = 0
+        self.x = x
+        self.y = y
+
+
+#################################################################################
+class Troop:
+    __slots__ = ("id", "owner", "src", "dst", "num_cyborgs", "time_left")
+
+    def __init__(self, troop_id, owner, src, dst, num_cyborgs, time_left):
+        self.id = troop_id
+        self.owner = owner
+        self.src = src
+        self.dst = dst
+        self.num_cyborgs = num_cyborgs
+        self.time_left = time_left
+
+
+#################################################################################
+class Bomb:
+    __slots__ = ("id", "owner", "src", "dst", "time_left")
+
+    def __init__(self, bomb_id, owner, src, dst, time_left):
+        self.id = bomb_id
+        self.owner = owner
+        self.src = src
+        self.dst = dst
+        self.time_left = time_left
+
+
+#################################################################################
+# Deterministic re-implementation of the Ghost in the Cell rules the bot models
+class Referee:
+    def __init__(self, seed, num_factories=None, max_turns=MAX_TURNS):
+        self.rand = random.Random(seed)
+        self.max_turns = max_turns
+        self.turn = 0
+        self.factories = self.__generate_factories(num_factories)
+        self.distances = self.__generate_distances()
+        self.troops = []
+        self.bombs = []
+        self.bombs_left = [MAX_BOMBS, MAX_BOMBS]
+        self.next_entity_id = len(self.factories)
+        self.errors = [0, 0]    # Invalid orders per player
+
+    # Factory 0 sits in the middle, every other factory has a mirrored twin so both players start even
+    def __generate_factories(self, num_factories):
+        if num_factories is None:
+            num_factories = self.rand.randrange(MIN_FACTORIES, MAX_FACTORIES + 1, 2)
+        if num_factories % 2 == 0:
+            raise ValueError("Factory count must be odd, got {}".format(num_factories))
+
+        factories = [Factory(0, MAP_WIDTH // 2, MAP_HEIGHT // 2, production=0)]
+        min_gap = 2 * FACTORY_RADIUS + 100
+        while len(factories) < num_factories:
+            x = self.rand.randint(FACTORY_RADIUS, MAP_WIDTH // 2 - FACTORY_RADIUS)
+            y = self.rand.randint(FACTORY_RADIUS, MAP_HEIGHT - FACTORY_RADIUS)
+            mirror_x, mirror_y = MAP_WIDTH - x, MAP_HEIGHT - y
+            if any(math.hypot(f.x - px, f.y - py) < min_gap
+                   for f in factories for px, py in ((x, y), (mirror_x, mirror_y))):
+                continue
+            production = self.rand.randint(0, MAX_PRODUCTION)
+            num_cyborgs = self.rand.randint(0, 5 * production)
+            factories.append(Factory(len(factories), x, y, production, num_cyborgs))
+            factories.append(Factory(len(factories), mirror_x, mirror_y, production, num_cyborgs))
+
+        start_cyborgs = self.rand.randint(15, 30)
+        start_production = self.rand.randint(1, MAX_PRODUCTION)
+        for player, factory in enumerate(factories[1:3]):
+            factory.owner = player
+            factory.num_cyborgs = start_cyborgs
+            factory.production = start_production
+        return factories
+
+    def __generate_distances(self):
+        distances = [[0] * len(self.factories) for _ in self.factories]
+        for u in self.factories:
+            for v in self.factories:
+                if u.id < v.id:
+                    gap = math.hypot(u.x - v.x, u.y - v.y) - 2 * FACTORY_RADIUS
+                    dist = min(MAX_DISTANCE, max(1, int(round(gap / DISTANCE_SCALE))))
+                    distances[u.id][v.id] = distances[v.id][u.id] = dist
+        return distances
+
+    # Owners as seen by a player: 1 = them, -1 = opponent, 0 = neutral
+    @staticmethod
+    def __relative(owner, player):
+        if owner == NEUTRAL:
+            return 0
+        return 1 if owner == player else -1
+
+    def init_block(self):
+        num_factories = len(self.factories)
+        lines = [str(num_factories), str(num_factories * (num_factories - 1) // 2)]
+        lines += ["{} {} {}".format(u, v, self.distances[u][v])
+                  for u in range(num_factories) for v in range(u + 1, num_factories)]
+        return ("\n".join(lines) + "\n").encode()
+
+    def turn_block(self, player):
+        lines = ["{} FACTORY {} {} {} {} 0".format(f.id, self.__relative(f.owner, player), f.num_cyborgs,
+                                                    f.production, f.disabled)
+                 for f in self.factories]
+        lines += ["{} TROOP {} {} {} {} {}".format(t.id, self.__relative(t.owner, player), t.src, t.dst,
+                                                   t.num_cyborgs, t.time_left)
+                  for t in self.troops]
+        for b in self.bombs:
+            mine = b.owner == player
+            lines.append("{} BOMB {} {} {} {} 0".format(b.id, self.__relative(b.owner, player), b.src,
+                                                         b.dst if mine else -1, b.time_left if mine else -1))
+        return "{}\n{}\n".format(len(lines), "\n".join(lines)).encode()
+
+    def __new_id(self):
+        entity_id = self.next_entity_id
+        self.next_entity_id += 1
+        return entity_id
+
+    def __valid_route(self, player, src, dst):
+        return (0 <= src < len(self.factories) and 0 <= dst < len(self.factories) and src != dst
+                and self.factories[src].owner == player)
+
+    def __execute(self, player, command):
+        for action in command.split(";"):
+            words = action.split()
+            if not words or words[0] in ("WAIT", "MSG"):
+                continue
+            try:
+                args = [int(word) for word in words[1:]]
+                if words[0] == "MOVE":
+                    src, dst, num_cyborgs = args
+                    if not self.__valid_route(player, src, dst) or num_cyborgs <= 0:
+                        raise ValueError
+                    num_cyborgs = min(num_cyborgs, self.factories[src].num_cyborgs)
+                    if num_cyborgs > 0:
+                        self.factories[src].num_cyborgs -= num_cyborgs
+                        self.troops.append(Troop(self.__new_id(), player, src, dst, num_cyborgs,
+                                                 self.distances[src][dst]))
+                elif words[0] == "BOMB":
+                    src, dst = args
+                    if not self.__valid_route(player, src, dst) or self.bombs_left[player] == 0:
+                        raise ValueError
+                    self.bombs_left[player] -= 1
+                    self.bombs.append(Bomb(self.__new_id(), player, src, dst, self.distances[src][dst]))
+                elif words[0] == "INC":
+                    src, = args
+                    factory = self.factories[src]
+                    if factory.owner != player:
+                        raise ValueError
+                    if factory.production < MAX_PRODUCTION and factory.num_cyborgs >= INC_COST:
+                        factory.num_cyborgs -= INC_COST
+                        factory.production += 1
+                else:
+                    raise ValueError
+            except (ValueError, IndexError):
+                self.errors[player] += 1
+
+    def __solve_battles(self):
+        arriving = {}   # dst -> [player 0 cyborgs, player 1 cyborgs]
+        for troop in self.troops:
+            if troop.time_left <= 0:
+                arriving.setdefault(troop.dst, [0, 0])[troop.owner] += troop.num_cyborgs
+        self.troops = [troop for troop in self.troops if troop.time_left > 0]
+
+        for dst, (first, second) in arriving.items():
+            # Troops fight each other, then the survivors fight the garrison
+            if first == second:
+                continue
+            owner, survivors = (0, first - second) if first > second else (1, second - first)
+            factory = self.factories[dst]
+            if factory.owner == owner:
+                factory.num_cyborgs += survivors
+            elif survivors > factory.num_cyborgs:
+                factory.owner = owner
+                factory.num_cyborgs = survivors - factory.num_cyborgs
+            else:
+                factory.num_cyborgs -= survivors
+
+    def __explode_bombs(self):
+        for bomb in self.bombs:
+            if bomb.time_left <= 0:
+                factory = self.factories[bomb.dst]
+                factory.num_cyborgs -= min(factory.num_cyborgs, max(BOMB_MIN_DAMAGE, factory.num_cyborgs // 2))
+                factory.disabled = BOMB_DISABLE_TURNS
+        self.bombs = [bomb for bomb in self.bombs if bomb.time_left > 0]
+
+    # One game turn given both players' command strings
+    def step(self, commands):
+        self.turn += 1
+        for entity in self.troops + self.bombs:
+            entity.time_left -= 1
+        for player, command in enumerate(commands):
+            self.__execute(player, command)
+        for factory in self.factories:
+            if factory.disabled > 0:
+                factory.disabled -= 1
+            elif factory.owner != NEUTRAL:
+                factory.num_cyborgs += factory.production
+        self.__solve_battles()
+        self.__explode_bombs()
+
+    def score(self, player):
+        return (sum(f.num_cyborgs for f in self.factories if f.owner == player)
+                + sum(t.num_cyborgs for t in self.troops if t.owner == player))
+
+    def alive(self, player):
+        return (any(f.owner == player for f in self.factories)
+                or any(t.owner == player for t in self.troops))
+
+    # None while the game is running, else the winning player index or -1 for a draw
+    def winner(self):
+        alive = [self.alive(0), self.alive(1)]
+        if alive[0] and alive[1] and self.turn < self.max_turns:
+            return None
+        if alive[0] != alive[1]:
+            return 0 if alive[0] else 1
+        scores = [self.score(0), self.score(1)]
+        if scores[0] == scores[1]:
+            return -1
+        return 0 if scores[0] > scores[1] else 1
+
+
+#################################################################################
+# Bot driven through its callable entry points, inside this process
+class InProcessBot:
+    __modules = {}      # (path, slot) -> module, each player slot gets its own module globals
+
+    def __init__(self, path=BOT_PATH, slot=0, seed=None, params=None):
+        self.bot = self.__load(path, slot)
+        self.seed = seed
+        self.params = self.bot.Params() if params is None else self.bot.Params.from_dict(params)
+        self.state = None
+        self.msg_generator = None
+
+    @classmethod
+    def __load(cls, path, slot):
+        key = (os.path.abspath(path), slot)
+        if key not in cls.__modules:
+            spec = importlib.util.spec_from_file_location("gitc_bot_{}".format(slot), key[0])
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            cls.__modules[key] = module
+        return cls.__modules[key]
+
+    def start(self, init_block):
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.state, self.msg_generator = self.bot.init(self.bot.InputReader(io.BytesIO(init_block)), self.seed,
+                                                           self.params)
+
+    def play(self, turn_block):
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.bot.read_turn(self.state, self.bot.InputReader(io.BytesIO(turn_block)))
+            return self.bot.play_turn(self.state, self.msg_generator)
+
+    def close(self):
+        pass
+
+
+#################################################################################
+# Bot run as a separate process, talking over pipes exactly like the arena, block-buffered stdout included
+class PipeBot:
+    def __init__(self, path=BOT_PATH, params=None):
+        env = {name: value for name, value in os.environ.items() if name != "PYTHONUNBUFFERED"}
+        self.params_file = None
+        if params is not None:
+            with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+                json.dump(params, f)
+            self.params_file = f.name
+            env["GITC_PARAMS"] = f.name
+        else:
+            env["GITC_PARAMS"] = ""     # Defaults, not whatever params.json a tuning run left behind
+        self.process = subprocess.Popen([sys.executable, path], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, env=env)
+        self.init_block = b""
+
+    def start(self, init_block):
+        self.init_block = init_block    # Sent along with the first turn, like the arena does
+
+    def play(self, turn_block):
+        self.process.stdin.write(self.init_block + turn_block)
+        self.process.stdin.flush()
+        self.init_block = b""
+        if not select.select([self.process.stdout], [], [], PIPE_TIMEOUT_S)[0]:
+            raise TimeoutError("No command within {} s, is stdout flushed?".format(PIPE_TIMEOUT_S))
+        line = self.process.stdout.readline()
+        if not line:
+            raise EOFError("Bot exited")
+        return line.decode().strip()
+
+    # Closing stdin lets the bot see end of input and finish cleanly (e.g. flush a replay)
+    def close(self):
+        self.process.stdin.close()
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        if self.params_file:
+            os.remove(self.params_file)
+
+
+def make_bot(path, slot, pipe, seed=None, params=None):
+    return PipeBot(path, params) if pipe else InProcessBot(path, slot, seed, params)
+
+
+# Plays one seeded match, bot_paths[0] is player 0 unless swapped. bot_params holds Params dicts, None = defaults.
+# A transcript list collects (player, turn block, command) for every turn played.
+def play_match(seed, bot_paths=(BOT_PATH, BOT_PATH), pipe=False, swap=False, num_factories=None,
+               max_turns=MAX_TURNS, transcript=None, bot_params=(None, None)):
+    order = (1, 0) if swap else (0, 1)
+    referee = Referee(seed, num_factories, max_turns)
+    bots = [make_bot(bot_paths[order[player]], player, pipe, seed, bot_params[order[player]]) for player in range(2)]
+    crashed = None
+    try:
+        init_block = referee.init_block()
+        for bot in bots:
+            bot.start(init_block)
+        while referee.winner() is None:
+            commands = []
+            for player, bot in enumerate(bots):
+                turn_block = referee.turn_block(player)
+                try:
+                    commands.append(bot.play(turn_block))
+                except Exception:
+                    crashed = player
+                    break
+                if transcript is not None:
+                    transcript.append((player, turn_block, commands[-1]))
+            if crashed is not None:
+                break
+            referee.step(commands)
+    finally:
+        for bot in bots:
+            bot.close()
+
+    winner = 1 - crashed if crashed is not None else referee.winner()
+    return {"seed": seed,
+            "winner": order[winner] if winner >= 0 else -1,     # Index into bot_paths
+            "crashed": order[crashed] if crashed is not None else None,
+            "turns": referee.turn,
+            "scores": [referee.score(order.index(i)) for i in range(2)],
+            "errors": [referee.errors[order.index(i)] for i in range(2)]}
+
+
+def _play_seed(args):
+    seed, bot_paths, pipe, num_factories, max_turns = args
+    return play_match(seed, bot_paths, pipe, swap=seed % 2 == 1, num_factories=num_factories, max_turns=max_turns)
+
+
+# Runs seeded matches across a process pool, yields results as they finish
+def run_batch(seeds, bot_paths=(BOT_PATH, BOT_PATH), pipe=False, workers=None, num_factories=None,
+              max_turns=MAX_TURNS):
+    jobs = [(seed, tuple(bot_paths), pipe, num_factories, max_turns) for seed in seeds]
+    with multiprocessing.Pool(workers or os.cpu_count()) as pool:
+        for result in pool.imap_unordered(_play_seed, jobs):
+            yield result
+
+
+def summarize(results):
+    games = len(results)
+    wins = [sum(1 for r in results if r["winner"] == i) for i in range(2)]
+    draws = sum(1 for r in results if r["winner"] == -1)
+    crashes = [sum(1 for r in results if r["crashed"] == i) for i in range(2)]
+    return ("{} games: bot 1 won {} ({:.1%}), bot 2 won {} ({:.1%}), {} draws, crashes {}/{}, mean {:.0f} turns"
+            .format(games, wins[0], wins[0] / float(games), wins[1], wins[1] / float(games), draws,
+                    crashes[0], crashes[1], sum(r["turns"] for r in results) / float(games)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline Ghost in the Cell matches between two bots")
+    parser.add_argument("--bot1", default=BOT_PATH)
+    parser.add_argument("--bot2", default=BOT_PATH)
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0, help="first seed, games use seed .. seed + games - 1")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--factories", type=int, default=None)
+    parser.add_argument("--turns", type=int, default=MAX_TURNS)
+    parser.add_argument("--pipe", action="store_true", help="run bots as subprocesses over stdin/stdout")
+    args = parser.parse_args()
+
+    seeds = range(args.seed, args.seed + args.games)
+    results = list(run_batch(seeds, (args.bot1, args.bot2), args.pipe, args.workers, args.factories, args.turns))
+    print(summarize(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+import argparse
+import io
+import mmap
+import os
+import struct
+
+import numpy as np
+
+import test as bot
+
+# File = FILE_MAGIC, game records, then the game index: offsets (uint64 each), game count (uint64), INDEX_MAGIC.
+# Game record = header, links (int32 x 3 per link), turn row offsets (uint32, turns + 1),
+# entity columns (int32, ENTITY_COLUMNS x rows, one column after the other), command offsets (uint32, turns + 1),
+# command bytes padded to 4. Everything is little endian.
+FILE_MAGIC = b"GITCRPL1"
+INDEX_MAGIC = b"GITCIDX1"
+GAME_MAGIC = b"GITCGAME"
+GAME_HEADER = struct.Struct("<8sIIIII")   # magic, factories, links, turns, entity rows, command bytes
+INDEX_FOOTER = struct.Struct("<Q8s")     # game count, magic
+
+
+def _pad(size):
+    return (-size) % 4
+
+
+#################################################################################
+# Buffers one game at a time and appends it to the replay file when the game ends
+class ReplayRecorder:
+    def __init__(self, path):
+        self.path = path
+        self.__num_factories = 0
+        self.__links = None
+        self.__turns = []       # (entities, command)
+
+    def start_game(self, num_factories, links):
+        self.__num_factories = num_factories
+        self.__links = np.asarray(links, dtype=np.int32).reshape(-1, 3)
+        self.__turns = []
+
+    def record_turn(self, entities, command):
+        self.__turns.append((np.asarray(entities, dtype=np.int32).reshape(-1, bot.ENTITY_COLUMNS), command))
+
+    def end_game(self):
+        if self.__links is None:
+            return
+        record = self.__encode()
+        offsets = read_index(self.path) if os.path.exists(self.path) else []
+        with open(self.path, "r+b" if os.path.exists(self.path) else "wb") as f:
+            if offsets:
+                f.seek(-(INDEX_FOOTER.size + 8 * len(offsets)), os.SEEK_END)   # Overwrite the old index
+            else:
+                f.truncate(0)
+                f.write(FILE_MAGIC)
+            offsets.append(f.tell())
+            f.write(record)
+            f.write(np.array(offsets, dtype="<u8").tobytes())
+            f.write(INDEX_FOOTER.pack(len(offsets), INDEX_MAGIC))
+            f.truncate()
+        self.__links = None
+
+    def __encode(self):
+        row_offsets = np.zeros(len(self.__turns) + 1, dtype="<u4")
+        row_offsets[1:] = np.cumsum([len(entities) for entities, _ in self.__turns])
+        if self.__turns:
+            rows = np.concatenate([entities for entities, _ in self.__turns])
+        else:
+            rows = np.zeros((0, bot.ENTITY_COLUMNS), dtype=np.int32)
+        commands = [command.encode() for _, command in self.__turns]
+        cmd_offsets = np.zeros(len(commands) + 1, dtype="<u4")
+        cmd_offsets[1:] = np.cumsum([len(command) for command in commands])
+        cmd_bytes = b"".join(commands)
+
+        out = io.BytesIO()
+        out.write(GAME_HEADER.pack(GAME_MAGIC, self.__num_factories, len(self.__links), len(self.__turns),
+                                   len(rows), len(cmd_bytes)))
+        out.write(self.__links.astype("<i4").tobytes())
+        out.write(row_offsets.tobytes())
+        out.write(np.ascontiguousarray(rows.T, dtype="<i4").tobytes())     # Columnar
+        out.write(cmd_offsets.tobytes())
+        out.write(cmd_bytes + b"\0" * _pad(len(cmd_bytes)))
+        return out.getvalue()
+
+
+def read_index(path):
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size < len(FILE_MAGIC) + INDEX_FOOTER.size:
+            return []
+        f.seek(-INDEX_FOOTER.size, os.SEEK_END)
+        count, magic = INDEX_FOOTER.unpack(f.read(INDEX_FOOTER.size))
+        if magic != INDEX_MAGIC:
+            raise ValueError("{} has no replay index".format(path))
+        f.seek(-(INDEX_FOOTER.size + 8 * count), os.SEEK_END)
+        return np.frombuffer(f.read(8 * count), dtype="<u8").tolist()
+
+
+#################################################################################
+# One recorded game, every array is a view into the memory-mapped file
+class ReplayGame:
+    def __init__(self, buffer, offset):
+        magic, self.num_factories, num_links, self.num_turns, num_rows, cmd_size = \
+            GAME_HEADER.unpack_from(buffer, offset)
+        if magic != GAME_MAGIC:
+            raise ValueError("No game record at offset {}".format(offset))
+        offset += GAME_HEADER.size
+        self.links = np.frombuffer(buffer, dtype="<i4", count=num_links * 3, offset=offset).reshape(num_links, 3)
+        offset += self.links.nbytes
+        self.__row_offsets = np.frombuffer(buffer, dtype="<u4", count=self.num_turns + 1, offset=offset)
+        offset += self.__row_offsets.nbytes
+        self.__columns = np.frombuffer(buffer, dtype="<i4", count=num_rows * bot.ENTITY_COLUMNS,
+                                       offset=offset).reshape(bot.ENTITY_COLUMNS, num_rows)
+        offset += self.__columns.nbytes
+        self.__cmd_offsets = np.frombuffer(buffer, dtype="<u4", count=self.num_turns + 1, offset=offset)
+        offset += self.__cmd_offsets.nbytes
+        self.__commands = memoryview(buffer)[offset:offset + cmd_size]
+
+    def __len__(self):
+        return self.num_turns
+
+    # (entities, 7) rows of turn n, same layout as InputReader.read_entities
+    def entities(self, n):
+        return self.__columns[:, self.__row_offsets[n]:self.__row_offsets[n + 1]].T
+
+    def command(self, n):
+        return bytes(self.__commands[self.__cmd_offsets[n]:self.__cmd_offsets[n + 1]]).decode()
+
+    def turns(self):
+        for n in range(self.num_turns):
+            yield self.entities(n), self.command(n)
+
+
+#################################################################################
+# Random access to game m, turn n without touching anything recorded before it
+class ReplayReader:
+    def __init__(self, path):
+        self.__file = open(path, "rb")
+        self.__buffer = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.__buffer[:len(FILE_MAGIC)] != FILE_MAGIC:
+            raise ValueError("{} is not a replay file".format(path))
+        count, magic = INDEX_FOOTER.unpack_from(self.__buffer, len(self.__buffer) - INDEX_FOOTER.size)
+        if magic != INDEX_MAGIC:
+            raise ValueError("{} has no replay index".format(path))
+        self.__offsets = np.frombuffer(self.__buffer, dtype="<u8", count=count,
+                                       offset=len(self.__buffer) - INDEX_FOOTER.size - 8 * count)
+
+    def __len__(self):
+        return len(self.__offsets)
+
+    def game(self, m):
+        return ReplayGame(self.__buffer, int(self.__offsets[m]))
+
+    def __iter__(self):
+        for m in range(len(self)):
+            yield self.game(m)
+
+    def close(self):
+        self.__offsets = None
+        try:
+            self.__buffer.close()
+        except BufferError:
+            pass    # Games handed out still hold views, the map goes away with them
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Self-play through the referee, recording player 0's view of every game
+def record_matches(path, seeds, num_factories=None):
+    import referee
+    recorder = ReplayRecorder(path)
+    for seed in seeds:
+        transcript = []
+        match = referee.Referee(seed, num_factories)
+        referee.play_match(seed, num_factories=num_factories, transcript=transcript)
+        reader = bot.InputReader(io.BytesIO(match.init_block()))
+        factory_count = reader.read_int()
+        recorder.start_game(factory_count, reader.read_table(reader.read_int(), 3))
+        for player, turn_block, command in transcript:
+            if player == 0:
+                recorder.record_turn(bot.InputReader(io.BytesIO(turn_block)).read_entities(), command)
+        recorder.end_game()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record and inspect binary Ghost in the Cell replays")
+    commands = parser.add_subparsers(dest="command", required=True)
+    record = commands.add_parser("record", help="append seeded self-play games")
+    record.add_argument("path")
+    record.add_argument("--games", type=int, default=10)
+    record.add_argument("--seed", type=int, default=0)
+    record.add_argument("--factories", type=int, default=None)
+    show = commands.add_parser("show", help="print one turn of one game")
+    show.add_argument("path")
+    show.add_argument("--game", type=int, default=0)
+    show.add_argument("--turn", type=int, default=0)
+    info = commands.add_parser("info", help="list the games in a file")
+    info.add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record_matches(args.path, range(args.seed, args.seed + args.games), args.factories)
+    with ReplayReader(args.path) as replays:
+        if args.command == "show":
+            game = replays.game(args.game)
+            print(game.entities(args.turn))
+            print(game.command(args.turn))
+        else:
+            for m, game in enumerate(replays):
+                print("game {}: {} factories, {} turns".format(m, game.num_factories, len(game)))
+
+
+if __name__ == "__main__":
+    main()
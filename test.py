@@ -1,18 +1,62 @@
+import contextlib
+import heapq
+import itertools
+import json
 import random
 import sys
 import math
+import os
+import time
 
 import datetime
 
+import numpy as np
+
 PLAYER_ID_SELF = 1
 PLAYER_ID_NEUTRAL = 0
 PLAYER_ID_OPPONENT = -1
 
 MAX_BOMBS = 2
 
+# Move search: rollout length in turns, value of one production point per turn, candidate move sets per turn
+SEARCH_DEPTH = 10
+SEARCH_RATE_WEIGHT = 10
+SEARCH_MAX_CANDIDATES = 16
+SEARCH_ROLLOUT_MS = 2.0     # Per candidate until a rollout is measured, one alone takes 1-2 ms, batched ones less each
+THREAT_WEIGHT = 0.0     # Any weight on reachable enemy garrisons made the bot too passive in self-play
+TRANSPOSITION_BITS = 14     # 16384 rollout scores kept across turns
+ZOBRIST_SEED = 0x61746331
+ALLOCATION_WINDOWS = 3      # Arrival windows tried per target, from the earliest one all sources together can make
+HASH_MASK = (1 << 64) - 1
+
+PARAMS_PATH = os.environ.get("GITC_PARAMS", os.path.join(os.path.dirname(os.path.abspath(__file__)), "params.json"))
+
+# Arena limits are 1000 ms for the first turn and 50 ms after, keep a margin for I/O
+TURN_BUDGET_MS = float(os.environ.get("GITC_TURN_BUDGET_MS", 40))
+FIRST_TURN_BUDGET_MS = float(os.environ.get("GITC_FIRST_TURN_BUDGET_MS", 900))
+
+# Offline telemetry: per-turn JSONL ("-" = summary on stderr only), a turn range like "10-20" to run under
+# cProfile, and where to dump its stats (top functions go to stderr otherwise). All off by default.
+TELEMETRY_PATH = os.environ.get("GITC_TELEMETRY")
+PROFILE_TURNS = os.environ.get("GITC_PROFILE")
+PROFILE_PATH = os.environ.get("GITC_PROFILE_OUT")
+
 CMD_MOVE = "MOVE"
 CMD_WAIT = "WAIT"
 CMD_BOMB = "BOMB"
+CMD_INC = "INC"
+CMD_MSG = "MSG"
+
+INC_COST = 10       # Cyborgs spent to raise a factory's production by one
+
+ENTITY_FACTORY = 0
+ENTITY_TROOP = 1
+ENTITY_BOMB = 2
+ENTITY_COLUMNS = 7      # id, type, arg_1 .. arg_5
+
+MAX_DISTANCE = 20     # Longest link the arena generates
+MAX_RATE = 3          # Highest production a factory can reach
+DISTANCE_INF = np.iinfo(np.int32).max // 2     # Unreachable, still safe to add twice
 
 
 #################################################################################
@@ -58,35 +102,36 @@ class MessageGenerator:
     __msg_sets.append(__challenge_msgs)
 
     def __get_rand_wait(self):
-        return random.randint(self.__base, self.__base + self.__range)
+        return self.__rand.randint(self.__base, self.__base + self.__range)
 
     def get(self):
         if self.__wait == 0:
-            self.__curr_msg = self.__msgs[random.randrange(len(self.__msgs))]
+            self.__curr_msg = self.__msgs[self.__rand.randrange(len(self.__msgs))]
             self.__wait = self.__get_rand_wait()
         else:
             self.__wait -= 1
         return self.__curr_msg
 
-    def __init__(self, base=5, rand_range=7):
-        random.seed(datetime.datetime.now().microsecond)
+    # seed=None picks messages from the wall clock, offline runs pass a seed to stay reproducible
+    def __init__(self, base=5, rand_range=7, seed=None):
+        self.__rand = random.Random(datetime.datetime.now().microsecond if seed is None else seed)
         self.__base = base
         self.__range = rand_range
         self.__wait = 0
-        self.__msgs = self.__msg_sets[random.randrange(len(self.__msg_sets))]
+        self.__msgs = self.__msg_sets[self.__rand.randrange(len(self.__msg_sets))]
         self.__curr_msg = ""
 
 
 #################################################################################
 class Command:
-    __id = 0
+    __ids = itertools.count()    # Shared by every command, an instance counter would give them all id 0
 
-    def __init__(self, src=-1, dst=-1, time_left=0):
-        self.id = self.__id
-        self.__id += 1
+    def __init__(self, src=-1, dst=-1, num_cyborgs=None):
+        self.id = next(Command.__ids)
         self.src = src
         self.dst = dst
-        self.time_left = time_left
+        self.num_cyborgs = num_cyborgs      # Share of a split attack to relay, None relays what the path needs
+        self.due = -1       # Turn the command runs on, set by the scheduler
 
     def __repr__(self):
         return "{} {} {}".format(CMD_MOVE, self.src, self.dst)
@@ -96,19 +141,210 @@ class Command:
 
 
 #################################################################################
-class Timer:
-    __id = 0
+# Timing wheel of pending commands keyed on their due turn, one slot per turn ahead.
+# Dispatch only touches the slot that is due and cancelling is a dict delete.
+class CommandScheduler:
+    def __init__(self, size=MAX_DISTANCE + 1):
+        self.__slots = [{} for _ in range(size)]   # due % size -> {id: Command}
+        self.__turn = 0
+        self.__count = 0
+        self.__recent = []      # Scheduled this turn, for rollback
+
+    def __len__(self):
+        return self.__count
+
+    def __iter__(self):
+        for slot in self.__slots:
+            yield from slot.values()
+
+    def schedule(self, cmd, delay):
+        if delay >= len(self.__slots):
+            self.__grow(delay + 1)
+        cmd.due = self.__turn + max(delay, 1)
+        self.__slots[cmd.due % len(self.__slots)][cmd.id] = cmd
+        self.__recent.append(cmd)
+        self.__count += 1
+
+    def cancel(self, cmd):
+        if self.__slots[cmd.due % len(self.__slots)].pop(cmd.id, None) is not None:
+            self.__count -= 1
+
+    def tick(self):
+        self.__turn += 1
+        self.__recent = []
+
+    # Commands due this turn in the order they were first created, removed from the wheel
+    def pop_due(self):
+        index = self.__turn % len(self.__slots)
+        due = self.__slots[index]
+        self.__slots[index] = {}
+        self.__count -= len(due)
+        return sorted(due.values(), key=lambda cmd: cmd.id)
+
+    def mark(self):
+        return len(self.__recent)
+
+    # Cancel everything scheduled since mark()
+    def rollback(self, mark):
+        for cmd in self.__recent[mark:]:
+            self.cancel(cmd)
+        del self.__recent[mark:]
+
+    def __grow(self, size):
+        commands = list(self)
+        self.__slots = [{} for _ in range(max(size, 2 * len(self.__slots)))]
+        for cmd in commands:
+            self.__slots[cmd.due % len(self.__slots)][cmd.id] = cmd
+
+
+#################################################################################
+# The actions of one turn, serialized once when the turn is done.
+# Per-source totals and (src, dst) sets make conflict checks O(1) instead of searching the command string.
+class ActionPlan:
+    def __init__(self, available=None):
+        self.__available = {} if available is None else available     # src -> cyborgs it can spend this turn
+        self.__actions = []         # (kind, src, dst, num_cyborgs, target)
+        self.__spent = {}           # src -> cyborgs moved out or spent on INC
+        self.__moves = {}           # (src, dst) -> MOVE actions between them
+        self.__bombs = set()        # (src, dst)
+        self.message = None
+
+    def __len__(self):
+        return len(self.__actions)
+
+    # dst is the first hop, target the factory the cyborgs are finally headed to
+    def move(self, src, dst, num_cyborgs, target=None):
+        self.__actions.append((CMD_MOVE, src, dst, num_cyborgs, dst if target is None else target))
+        self.__moves[(src, dst)] = self.__moves.get((src, dst), 0) + 1
+        self.__spend(src, num_cyborgs)
+
+    def bomb(self, src, dst):
+        self.__actions.append((CMD_BOMB, src, dst, 0, dst))
+        self.__bombs.add((src, dst))
+
+    def inc(self, factory_id):
+        self.__actions.append((CMD_INC, factory_id, -1, INC_COST, factory_id))
+        self.__spend(factory_id, INC_COST)
+
+    def __spend(self, src, num_cyborgs):
+        self.__spent[src] = self.__spent.get(src, 0) + num_cyborgs
+        if self.__spent[src] > self.__available.get(src, 0):
+            print("Error! Factory {} overdrawn ({} > {})".format(src, self.__spent[src], self.__available.get(src, 0)),
+                  file=sys.stderr)
+
+    def spent(self, src):
+        return self.__spent.get(src, 0)
+
+    def remaining(self, src):
+        return self.__available.get(src, 0) - self.__spent.get(src, 0)
+
+    def has_move(self, src, dst):
+        return (src, dst) in self.__moves
+
+    def has_bomb(self, src, dst):
+        return (src, dst) in self.__bombs
+
+    def overdrawn(self):
+        return [src for src, spent in self.__spent.items() if spent > self.__available.get(src, 0)]
+
+    # (src, target, num_cyborgs) of the moves since action index start, the form ForwardModel.send takes
+    def moves(self, start=0):
+        return [(src, target, num_cyborgs) for kind, src, dst, num_cyborgs, target in self.__actions[start:]
+                if kind == CMD_MOVE]
+
+    def mark(self):
+        return len(self.__actions)
+
+    # Drop every action added since mark()
+    def rollback(self, mark):
+        for kind, src, dst, num_cyborgs, target in self.__actions[mark:]:
+            if kind == CMD_BOMB:
+                self.__bombs.discard((src, dst))
+                continue
+            self.__spent[src] -= num_cyborgs
+            if kind == CMD_MOVE:
+                self.__moves[(src, dst)] -= 1
+                if self.__moves[(src, dst)] == 0:
+                    del self.__moves[(src, dst)]
+        del self.__actions[mark:]
 
+    def __str__(self):
+        parts = [] if self.message is None else ["{} {}".format(CMD_MSG, self.message)]
+        for kind, src, dst, num_cyborgs, target in self.__actions:
+            if kind == CMD_MOVE:
+                parts.append("{} {} {} {}".format(kind, src, dst, num_cyborgs))
+            elif kind == CMD_BOMB:
+                parts.append("{} {} {}".format(kind, src, dst))
+            else:
+                parts.append("{} {}".format(kind, src))
+        return ";".join(parts) if parts else CMD_WAIT
+
+
+#################################################################################
+# Planner heuristics, the defaults are the original hand-picked constants
+class Params:
+    def __init__(self,
+                 target_distance_weight=1.0,        # target score = (w_d * distance + w_c * cyborgs) / rate
+                 target_cyborg_weight=1.0,
+                 reinforce_fraction=0.5,            # share of a factory's cyborgs sent back when idle
+                 reinforce_locality_factor=1.0,     # only factories with locality > mean * factor reinforce
+                 bomb_rate_factor=1.0,              # bomb targets need rate >= mean rate * factor
+                 bomb_cyborg_factor=1.0,            # ... and cyborgs >= mean cyborgs * factor
+                 search_depth=SEARCH_DEPTH,
+                 search_rate_weight=SEARCH_RATE_WEIGHT,
+                 threat_weight=THREAT_WEIGHT):          # share of reachable enemy garrisons a factory must withstand
+        self.target_distance_weight = target_distance_weight
+        self.target_cyborg_weight = target_cyborg_weight
+        self.reinforce_fraction = reinforce_fraction
+        self.reinforce_locality_factor = reinforce_locality_factor
+        self.bomb_rate_factor = bomb_rate_factor
+        self.bomb_cyborg_factor = bomb_cyborg_factor
+        self.search_depth = int(search_depth)
+        self.search_rate_weight = search_rate_weight
+        self.threat_weight = threat_weight
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(**values)
+
+    # Missing file means defaults, the arena only ever sees those
+    @classmethod
+    def load(cls, path=PARAMS_PATH):
+        if not path or not os.path.exists(path):
+            return cls()
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
+
+    def key(self):
+        return json.dumps(self.to_dict(), sort_keys=True)
+
+    def __repr__(self):
+        return "Params({})".format(", ".join("{}={}".format(k, v) for k, v in sorted(self.to_dict().items())))
+
+
+#################################################################################
+# Monotonic high resolution timers, deltas are in milliseconds
+class Timer:
     def __init__(self):
-        self.__timers = {}    # id -> datetime
+        self.__timers = {}    # id -> perf_counter() at start
+        self.__next_id = 0
 
     def reserve_id(self):
-        return self.__id
+        i = self.__next_id
+        self.__next_id += 1
+        return i
 
-    def start(self, i=__id):
-        self.__timers[i] = datetime.datetime.now()
-        if i == self.__id:
-            self.__id += 1
+    def start(self, i=None):
+        if i is None:
+            i = self.reserve_id()
+        self.__timers[i] = time.perf_counter()
         return i
 
     def stop(self, i):
@@ -117,7 +353,7 @@ class Timer:
         return d
 
     def delta(self, i):
-        return datetime.datetime.now() - self.__timers[i]
+        return (time.perf_counter() - self.__timers[i]) * 1000.0
 
     def clear(self, i):
         if i in self.__timers:
@@ -126,9 +362,174 @@ class Timer:
 timer = Timer()
 
 
+#################################################################################
+# Time budget for one turn on a running timer, no timer means no deadline
+class Deadline:
+    def __init__(self, timer_id=None, budget_ms=math.inf):
+        self.__timer_id = timer_id
+        self.__budget_ms = budget_ms
+
+    def remaining(self):
+        if self.__timer_id is None:
+            return self.__budget_ms
+        return self.__budget_ms - timer.delta(self.__timer_id)
+
+    def expired(self):
+        return self.remaining() <= 0
+
+
+#################################################################################
+class Span:
+    __slots__ = ("telemetry", "name", "start")
+
+    def __init__(self, telemetry, name):
+        self.telemetry = telemetry
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.telemetry.add_time(self.name, (time.perf_counter() - self.start) * 1000.0)
+
+
+#################################################################################
+# Named phase timings and counters per turn, buffered and written as JSONL.
+# When disabled span() hands back one shared no-op context and nothing is recorded.
+class Telemetry:
+    def __init__(self, path=None, profile_turns=None, profile_path=None, flush_every=50):
+        self.enabled = bool(path)
+        self.turn = 0       # Turns started, 1 for the first
+        self.__path = None if path == "-" else path
+        self.__flush_every = flush_every
+        self.__null = contextlib.nullcontext()
+        self.__spans = {}       # name -> ms this turn
+        self.__counters = {}    # name -> count this turn
+        self.__totals = {}      # name -> [turns, total ms, max ms]
+        self.__buffer = []
+        self.__first_profiled, self.__last_profiled = self.__parse_range(profile_turns)
+        self.__profile_path = profile_path
+        self.__profiler = None
+
+    @staticmethod
+    def __parse_range(turns):
+        if not turns:
+            return 0, -1
+        first, _, last = str(turns).partition("-")
+        return int(first), int(last or first)
+
+    def span(self, name):
+        return Span(self, name) if self.enabled else self.__null
+
+    def add_time(self, name, ms):
+        self.__spans[name] = self.__spans.get(name, 0.0) + ms
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.__counters[name] = self.__counters.get(name, 0) + n
+
+    def start_turn(self):
+        self.turn += 1
+        if self.turn == self.__first_profiled:
+            import cProfile
+            self.__profiler = cProfile.Profile()
+        if self.__profiler is not None and self.turn <= self.__last_profiled:
+            self.__profiler.enable()
+
+    def end_turn(self, **counters):
+        if self.__profiler is not None:
+            self.__profiler.disable()
+        if not self.enabled:
+            return
+        for name, n in counters.items():
+            self.count(name, n)
+        for name, ms in self.__spans.items():
+            total = self.__totals.setdefault(name, [0, 0.0, 0.0])
+            total[0] += 1
+            total[1] += ms
+            total[2] = max(total[2], ms)
+        self.__buffer.append(json.dumps({"turn": self.turn,
+                                         "ms": {name: round(ms, 4) for name, ms in self.__spans.items()},
+                                         "counters": self.__counters}))
+        self.__spans = {}
+        self.__counters = {}
+        if len(self.__buffer) >= self.__flush_every:
+            self.flush()
+
+    def flush(self):
+        if self.__path and self.__buffer:
+            with open(self.__path, "a") as f:
+                f.write("\n".join(self.__buffer) + "\n")
+        self.__buffer = []
+
+    def close(self):
+        self.flush()
+        if self.enabled:
+            print(self, file=sys.stderr)
+        if self.__profiler is not None:
+            if self.__profile_path:
+                self.__profiler.dump_stats(self.__profile_path)
+            else:
+                import pstats
+                pstats.Stats(self.__profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(25)
+            self.__profiler = None
+
+    def __str__(self):
+        return "telemetry over {} turns: {}".format(self.turn, ", ".join(
+            "{} {:.3f} ms avg {:.3f} max".format(name, total / turns, worst)
+            for name, (turns, total, worst) in self.__totals.items()))
+
+
+telemetry = Telemetry(TELEMETRY_PATH, PROFILE_TURNS, PROFILE_PATH)
+
+
+#################################################################################
+# Buffered reader over the referee's byte stream (stdin or a piped replay file)
+class InputReader:
+    __entity_codes = ((b"FACTORY", b"%d" % ENTITY_FACTORY),
+                      (b"TROOP", b"%d" % ENTITY_TROOP),
+                      (b"BOMB", b"%d" % ENTITY_BOMB))
+
+    def __init__(self, stream=None):
+        self.__stream = sys.stdin.buffer if stream is None else stream
+
+    def read_line(self):
+        line = self.__stream.readline()
+        if not line:
+            raise EOFError("EOF when reading a line")
+        return line
+
+    def read_int(self):
+        return int(self.read_line())
+
+    # Read num_rows lines in one go and decode them into a (num_rows, num_columns) int array
+    def read_table(self, num_rows, num_columns):
+        block = b"".join([self.read_line() for _ in range(num_rows)])
+        return self.decode_table(block, num_rows, num_columns)
+
+    @staticmethod
+    def decode_table(block, num_rows, num_columns):
+        table = np.fromstring(block, dtype=np.int64, sep=" ")
+        if table.size != num_rows * num_columns:
+            raise ValueError("Expected {}x{} integers, got {}".format(num_rows, num_columns, table.size))
+        return table.reshape(num_rows, num_columns)
+
+    # Entity block with the type column mapped to ENTITY_* codes
+    def read_entities(self):
+        entity_count = self.read_int()  # the number of entities (e.g. factories and troops)
+        block = b"".join([self.read_line() for _ in range(entity_count)])
+        for name, code in self.__entity_codes:
+            block = block.replace(name, code)
+        return self.decode_table(block, entity_count, ENTITY_COLUMNS)
+
+
 #################################################################################
 # Factory related data
 class Factory:
+    __slots__ = ("owner", "id", "cyborg_rate", "num_cyborgs", "locality")
+
     def __init__(self, factory_id):
         self.owner = 0      # 1 = me, -1 = opponent, 0 = neutral
         self.id = factory_id
@@ -136,6 +537,11 @@ class Factory:
         self.num_cyborgs = 0
         self.locality = -1
 
+    def copy_from(self, other):
+        self.owner = other.owner
+        self.cyborg_rate = other.cyborg_rate
+        self.num_cyborgs = other.num_cyborgs
+
     def __repr__(self):
         return self.__str__()
 
@@ -158,7 +564,12 @@ class Factory:
 #################################################################################
 # Troop related data
 class Troop:
-    def __init__(self, troop_id, owner, num_cyborgs, src, dst, time_left):
+    __slots__ = ("id", "owner", "num_cyborgs", "src", "dst", "time_left")
+
+    def __init__(self, troop_id=-1, owner=PLAYER_ID_NEUTRAL, num_cyborgs=0, src=-1, dst=-1, time_left=0):
+        self.set(troop_id, owner, num_cyborgs, src, dst, time_left)
+
+    def set(self, troop_id, owner, num_cyborgs, src, dst, time_left):
         self.id = troop_id
         self.owner = owner
         self.num_cyborgs = num_cyborgs
@@ -188,7 +599,12 @@ class Troop:
 
 #################################################################################
 class Bomb:
-    def __init__(self, bomb_id, owner, src, dst=-1, time_left=-1):
+    __slots__ = ("id", "owner", "src", "dst", "time_left")
+
+    def __init__(self, bomb_id=-1, owner=PLAYER_ID_NEUTRAL, src=-1, dst=-1, time_left=-1):
+        self.set(bomb_id, owner, src, dst, time_left)
+
+    def set(self, bomb_id, owner, src, dst=-1, time_left=-1):
         self.id = bomb_id
         self.owner = owner
         self.src = src
@@ -207,45 +623,610 @@ class Bomb:
 
 
 #################################################################################
+# Entities kept alive across turns, only the first len() are in play
+class EntityPool:
+    def __init__(self, entity_class):
+        self.__entity_class = entity_class
+        self.__entities = []
+        self.__count = 0
+
+    def acquire(self):
+        if self.__count == len(self.__entities):
+            self.__entities.append(self.__entity_class())
+        entity = self.__entities[self.__count]
+        self.__count += 1
+        return entity
+
+    def clear(self):
+        self.__count = 0
+
+    def __len__(self):
+        return self.__count
+
+    def __iter__(self):
+        return itertools.islice(self.__entities, self.__count)
+
+
+#################################################################################
+# Cyborgs arriving at each factory, indexed by turns until arrival and split by owner
+class ArrivalTimeline:
+    __owner_index = {PLAYER_ID_SELF: 0, PLAYER_ID_OPPONENT: 1}
+
+    def __init__(self, num_factories, horizon=MAX_DISTANCE + 1):
+        self.__arrivals = np.zeros((2, num_factories, horizon), dtype=np.int32)
+        self.__destinations = set()
+
+    @property
+    def horizon(self):
+        return self.__arrivals.shape[2]
+
+    def add(self, owner, dst, time_left, num_cyborgs):
+        if time_left >= self.horizon:
+            grown = np.zeros(self.__arrivals.shape[:2] + (time_left + 1,), dtype=np.int32)
+            grown[:, :, :self.horizon] = self.__arrivals
+            self.__arrivals = grown
+        self.__arrivals[self.__owner_index[owner], dst, time_left] += num_cyborgs
+        self.__destinations.add(dst)
+
+    def clear(self):
+        for dst in self.__destinations:
+            self.__arrivals[:, dst, :] = 0
+        self.__destinations.clear()
+
+    # Factories with at least one troop on the way
+    def destinations(self):
+        return self.__destinations
+
+    # Copy as a (2, factories, length) array, [0] = mine and [1] = opponent's
+    def to_array(self, length):
+        arrivals = np.zeros(self.__arrivals.shape[:2] + (length,), dtype=np.int32)
+        kept = min(length, self.horizon)
+        arrivals[:, :, :kept] = self.__arrivals[:, :, :kept]
+        return arrivals
+
+    # (turns until arrival, my cyborgs, opponent cyborgs) in arrival order
+    def arrivals(self, dst):
+        mine = self.__arrivals[0, dst]
+        theirs = self.__arrivals[1, dst]
+        times = np.flatnonzero(mine | theirs)
+        return zip(times.tolist(), mine[times].tolist(), theirs[times].tolist())
+
+
+#################################################################################
+# Routing engine: all-pairs shortest distances plus a next-hop table, kept in compact integer arrays
 class MinFactoryDistances:
     def __init__(self, num_factories):
-        self.__min_distances = [[(math.inf if m != n else 0) for n in range(num_factories)] for m in range(num_factories)]
-        self.__predecessors = [[-1 for n in range(num_factories)] for m in range(num_factories)]
+        self.__min_distances = np.full((num_factories, num_factories), DISTANCE_INF, dtype=np.int32)
+        self.__next_hops = np.full((num_factories, num_factories), -1, dtype=np.int32)     # (u,v) -> first hop u->v
+        np.fill_diagonal(self.__min_distances, 0)
         self.__num_factories = num_factories
-        self.__cached_paths = {}    # (u,v) -> [path]
+        self.__cached_paths = {}    # (u,v) -> [path], filled lazily
 
     def create_edge(self, u, v, dist):
-        self.__min_distances[u][v] = dist
-        self.__predecessors[u][v] = u   # identity
+        self.__min_distances[u, v] = dist
+        self.__next_hops[u, v] = v
 
     def get_distance(self, u, v):
-        return self.__min_distances[u][v]
+        dist = self.__min_distances.item(u, v)
+        return dist if dist < DISTANCE_INF else math.inf
+
+    @property
+    def distances(self):
+        return self.__min_distances
 
-    # Floyd-Warshall algorithm
+    # Floyd-Warshall algorithm, relaxing the whole matrix through k in one vectorized step
     def calculate(self):
+        dist = self.__min_distances
+        next_hops = self.__next_hops
         for k in range(self.__num_factories):
-            for u in range(self.__num_factories):
-                for v in range(self.__num_factories):
-                    if self.__min_distances[u][v] > (self.__min_distances[u][k] + self.__min_distances[k][v]):
-                        self.__min_distances[u][v] = self.__min_distances[u][k] + self.__min_distances[k][v]
-                        self.__predecessors[u][v] = self.__predecessors[k][v]       # Take the predecessor from k to v
+            via_k = dist[:, k, np.newaxis] + dist[np.newaxis, k, :]
+            shorter = via_k < dist
+            np.copyto(dist, via_k, where=shorter)
+            np.copyto(next_hops, next_hops[:, k, np.newaxis], where=shorter)    # Go towards k first
+        self.__cached_paths.clear()
 
     # Shortest path from u to v
     def __get_path(self, u, v):
-        path = []
-        k = v
-        while k != -1:      # -1 default predecessor for (u,u)
+        if u != v and self.__next_hops.item(u, v) == -1:
+            return [v]      # Unreachable
+        path = [u]
+        k = u
+        while k != v:
+            k = self.__next_hops.item(k, v)
             path.append(k)
-            k = self.__predecessors[u][k]
-        return path[::-1]
-
-    def cache_all_paths(self):
-        for u in range(self.__num_factories):
-            for v in range(self.__num_factories):
-                self.__cached_paths[(u, v)] = self.__get_path(u, v)
+        return path
 
     def get_cached_path(self, u, v):
-        return self.__cached_paths[(u, v)]
+        path = self.__cached_paths.get((u, v))
+        if path is None:
+            path = self.__get_path(u, v)
+            self.__cached_paths[(u, v)] = path
+        return path
+
+
+#################################################################################
+# Built once after the shortest paths: every factory's reachable neighbors by increasing distance,
+# locality (sum of shortest distances, lower = more central) and closeness centrality
+class GraphIndex:
+    def __init__(self, distances):
+        num_factories = len(distances)
+        reachable = (distances < DISTANCE_INF) & ~np.eye(num_factories, dtype=bool)
+        self.__neighbors = []       # u -> [(distance, v)] ascending
+        self.__distances = []       # u -> sorted distances, for bucket lookups
+        for u in range(num_factories):
+            order = np.flatnonzero(reachable[u])
+            order = order[np.argsort(distances[u, order], kind="stable")]
+            self.__neighbors.append(list(zip(distances[u, order].tolist(), order.tolist())))
+            self.__distances.append(distances[u, order])
+        self.locality = np.where(reachable, distances, 0).sum(axis=1)
+        self.centrality = np.where(self.locality > 0, reachable.sum(axis=1) / np.maximum(self.locality, 1), 0.0)
+
+    def neighbors(self, u):
+        return self.__neighbors[u]
+
+    # Neighbors of u at most radius away
+    def within(self, u, radius):
+        return self.__neighbors[u][:int(np.searchsorted(self.__distances[u], radius, side="right"))]
+
+    # Neighbors of u exactly dist away
+    def bucket(self, u, dist):
+        distances = self.__distances[u]
+        return self.__neighbors[u][int(np.searchsorted(distances, dist)):
+                                   int(np.searchsorted(distances, dist, side="right"))]
+
+
+#################################################################################
+# Per-factory pressure over the next turns, rebuilt once per turn from the arrival timeline.
+# balance[f, t] = garrison + production + net arrivals up to t - weight * enemy cyborgs able to reach f by t
+class ThreatMap:
+    def __init__(self, state, weight=THREAT_WEIGHT):
+        horizon = state.arrivals.horizon
+        factories = [state.factories[i] for i in range(len(state.factories))]
+        owner = np.array([f.owner for f in factories], dtype=np.int32)
+        cyborgs = np.array([f.num_cyborgs for f in factories], dtype=np.int32)
+        rate = np.array([f.cyborg_rate for f in factories], dtype=np.int32)
+        times = np.arange(horizon)
+
+        arrivals = state.arrivals.to_array(horizon)
+        self.mine = arrivals[0]     # (factories, horizon) cyborgs landing in t turns
+        self.theirs = arrivals[1]
+
+        self.balance = cyborgs[:, None] + rate[:, None] * times + np.cumsum(self.mine - self.theirs, axis=1)
+        if weight != 0:
+            # Enemy garrisons that could be sent now, counted from the turn they would land, distance + 1 away
+            distances = state.min_distances.distances + 1
+            enemy = np.where(owner == PLAYER_ID_OPPONENT, cyborgs, 0)
+            src, dst = np.nonzero((enemy[:, None] > 0) & (distances < horizon))
+            potential = np.zeros((len(factories), horizon), dtype=np.int32)
+            np.add.at(potential, (dst, distances[src, dst]), enemy[src])
+            self.balance = self.balance - weight * np.cumsum(potential, axis=1)
+        # Cyborgs that can leave now without the lowest point of the balance going negative, mine only
+        self.surplus = np.where(owner == PLAYER_ID_SELF,
+                                np.clip(np.floor(self.balance.min(axis=1)), 0, cyborgs), 0).astype(np.int32)
+
+
+#################################################################################
+# Random 64-bit keys for position hashing. Owner and rate are added as one key per value, cyborg counts as
+# count * key, so every change to a factory or an arrival slot is one add modulo 2^64.
+class Zobrist:
+    def __init__(self, num_factories, seed=ZOBRIST_SEED):
+        self.__rand = random.Random(seed)
+        owners = [PLAYER_ID_OPPONENT, PLAYER_ID_NEUTRAL, PLAYER_ID_SELF]
+        self.__owner = [{owner: self.__key() for owner in owners} for _ in range(num_factories)]
+        self.__rate = [[self.__key() for _ in range(MAX_RATE + 1)] for _ in range(num_factories)]
+        self.__cyborgs = [self.__key() for _ in range(num_factories)]
+        self.__arrivals = {PLAYER_ID_SELF: [[] for _ in range(num_factories)],
+                           PLAYER_ID_OPPONENT: [[] for _ in range(num_factories)]}    # Grown on demand
+        self.empty = sum(self.factory(f, PLAYER_ID_NEUTRAL, 0, 0) for f in range(num_factories)) & HASH_MASK
+
+    def __key(self):
+        return self.__rand.getrandbits(64)
+
+    def factory(self, f, owner, num_cyborgs, cyborg_rate):
+        return self.__owner[f][owner] + self.__rate[f][cyborg_rate] + num_cyborgs * self.__cyborgs[f]
+
+    def cyborgs(self, f, num_cyborgs):
+        return num_cyborgs * self.__cyborgs[f]
+
+    def arrival(self, owner, dst, time_left, num_cyborgs):
+        keys = self.__arrivals[owner][dst]
+        while len(keys) <= time_left:
+            keys.append(self.__key())
+        return num_cyborgs * keys[time_left]
+
+
+#################################################################################
+# Rollout scores by position hash, kept across turns. Two-way buckets, the entry used least recently is evicted.
+class TranspositionTable:
+    def __init__(self, size_bits=TRANSPOSITION_BITS):
+        size = 1 << size_bits
+        self.__mask = size - 1
+        self.__keys = [0] * size
+        self.__scores = [0.0] * size
+        self.__used = [-1] * size     # Turn of the last store or hit, -1 = empty
+        self.__turn = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def new_turn(self):
+        self.__turn += 1
+
+    def get(self, key):
+        i = key & self.__mask
+        for j in (i, i ^ 1):
+            if self.__used[j] >= 0 and self.__keys[j] == key:
+                self.__used[j] = self.__turn
+                self.hits += 1
+                return self.__scores[j]
+        self.misses += 1
+        return None
+
+    def put(self, key, score):
+        i = key & self.__mask
+        j = i ^ 1
+        if self.__keys[i] != key and (self.__keys[j] == key or self.__used[j] < self.__used[i]):
+            i = j
+        if self.__used[i] >= 0 and self.__keys[i] != key:
+            self.evicted += 1
+        self.__keys[i] = key
+        self.__scores[i] = score
+        self.__used[i] = self.__turn
+
+    def __str__(self):
+        return "transpositions: {}/{} hits, {} evicted".format(self.hits, self.hits + self.misses, self.evicted)
+
+
+# One turn of production then arrivals on (..., factories) arrays, for any number of candidates at once.
+# Arriving sides fight each other first, the survivors reinforce their own factory or fight the garrison,
+# neutral factories included, and take it when they outnumber it.
+def resolve_battles(owner, cyborgs, rate, mine, theirs):
+    cyborgs = cyborgs + rate * (owner != PLAYER_ID_NEUTRAL)
+    net = mine - theirs
+    attacker = np.sign(net)
+    amount = np.abs(net)
+    reinforced = (attacker == owner) & (amount > 0)
+    fought = (attacker != owner) & (amount > 0)
+    captured = fought & (amount > cyborgs)
+    cyborgs = np.where(reinforced, cyborgs + amount, cyborgs)
+    cyborgs = np.where(fought, np.abs(cyborgs - amount), cyborgs)
+    owner = np.where(captured, attacker, owner)
+    return owner, cyborgs
+
+
+#################################################################################
+# Array-backed model of production, arrivals and battles, used to roll move sets forward.
+# Every array has a leading candidate axis: K move sets are rolled forward together by batch().
+class ForwardModel:
+    def __init__(self, state, depth=SEARCH_DEPTH, rate_weight=SEARCH_RATE_WEIGHT):
+        self.depth = depth
+        self.rate_weight = rate_weight
+        self.distances = state.min_distances.distances
+        reachable = self.distances[self.distances < DISTANCE_INF]
+        length = depth + max(int(reachable.max()) + 1, state.arrivals.horizon) + 1
+        factories = [state.factories[i] for i in range(len(state.factories))]
+        self.owner = np.array([[f.owner for f in factories]], dtype=np.int32)           # (K, F)
+        self.cyborgs = np.array([[f.num_cyborgs for f in factories]], dtype=np.int32)   # (K, F)
+        self.rate = np.array([f.cyborg_rate for f in factories], dtype=np.int32)       # (F,), never changes
+        self.arrivals = state.arrivals.to_array(length)[np.newaxis]     # (K, 2, F, turns), [:, 0] = mine
+        self.zobrist = state.zobrist
+        self.hashes = [state.position_hash]     # Per candidate, follow the orders sent, None once rolled out
+
+    # One copy of candidate 0 per move set, each with its own moves sent
+    def batch(self, move_sets):
+        model = ForwardModel.__new__(ForwardModel)
+        model.depth = self.depth
+        model.rate_weight = self.rate_weight
+        model.distances = self.distances
+        model.owner = np.repeat(self.owner[:1], len(move_sets), axis=0)
+        model.cyborgs = np.repeat(self.cyborgs[:1], len(move_sets), axis=0)
+        model.rate = self.rate
+        model.arrivals = np.repeat(self.arrivals[:1], len(move_sets), axis=0)
+        model.zobrist = self.zobrist
+        model.hashes = [self.hashes[0]] * len(move_sets)
+        for k, moves in enumerate(move_sets):
+            for src, dst, num_cyborgs in moves:
+                model.send(PLAYER_ID_SELF, src, dst, num_cyborgs, k=k)
+        return model
+
+    # The candidates at the given indices, in that order
+    def take(self, rows):
+        model = ForwardModel.__new__(ForwardModel)
+        model.depth = self.depth
+        model.rate_weight = self.rate_weight
+        model.distances = self.distances
+        model.owner = self.owner[rows]
+        model.cyborgs = self.cyborgs[rows]
+        model.rate = self.rate
+        model.arrivals = self.arrivals[rows]
+        model.zobrist = self.zobrist
+        model.hashes = [self.hashes[k] for k in rows]
+        return model
+
+    # Troops ordered on turn t (0 = now) land on turn t + distance + 1, like the troops shown at time_left distance + 1
+    def send(self, owner, src, dst, num_cyborgs, t=0, k=0):
+        num_cyborgs = int(min(num_cyborgs, self.cyborgs[k, src]))
+        if num_cyborgs <= 0 or self.owner[k, src] != owner:
+            return
+        arrival = t + int(self.distances[src, dst]) + 1
+        self.cyborgs[k, src] -= num_cyborgs
+        self.arrivals[k, 0 if owner == PLAYER_ID_SELF else 1, dst, arrival] += num_cyborgs
+        self.hashes[k] = (self.hashes[k] - self.zobrist.cyborgs(src, num_cyborgs) +
+                          self.zobrist.arrival(owner, dst, arrival, num_cyborgs)) & HASH_MASK
+
+    # Same scoring as the greedy planner on shortest-path distances without relays, one target per source, for every
+    # candidate
+    def __greedy_policy(self, side, t):
+        sources = (self.owner == side) & (self.cyborgs > 0)
+        targets = (self.owner != side) & (self.rate > 0)
+        if not sources.any() or not targets.any():
+            return
+        reachable = self.distances < DISTANCE_INF
+        dist = np.where(reachable, self.distances, 0)      # DISTANCE_INF * rate overflows int32
+        need = self.cyborgs[:, np.newaxis, :] + \
+            ((self.owner == -side) * self.rate)[:, np.newaxis, :] * (dist + 1) + 1         # (K, sources, targets)
+        feasible = sources[:, :, np.newaxis] & targets[:, np.newaxis, :] & reachable & \
+            (need <= self.cyborgs[:, :, np.newaxis])
+        score = np.where(feasible, (dist + need) / np.maximum(self.rate, 1), np.inf)
+        best = score.argmin(axis=2)
+        ks, srcs = np.nonzero(np.take_along_axis(feasible, best[:, :, np.newaxis], axis=2)[:, :, 0])
+        dsts = best[ks, srcs]
+        num_cyborgs = need[ks, srcs, dsts]
+        self.cyborgs[ks, srcs] -= num_cyborgs
+        np.add.at(self.arrivals, (ks, 0 if side == PLAYER_ID_SELF else 1, dsts, t + dist[srcs, dsts] + 1), num_cyborgs)
+
+    # One turn: orders, then production and the arrivals of the turn
+    def step(self, t):
+        if t > 1:
+            self.__greedy_policy(PLAYER_ID_SELF, t - 1)
+            self.__greedy_policy(PLAYER_ID_OPPONENT, t - 1)
+        self.owner, self.cyborgs = resolve_battles(self.owner, self.cyborgs, self.rate,
+                                                   self.arrivals[:, 0, :, t], self.arrivals[:, 1, :, t])
+
+    # Material and production balance of every candidate after depth turns, troops still in flight count as material
+    def rollout(self):
+        self.hashes = [None] * len(self.hashes)
+        for t in range(1, self.depth + 1):
+            self.step(t)
+        mine = self.owner == PLAYER_ID_SELF
+        theirs = self.owner == PLAYER_ID_OPPONENT
+        in_flight = self.arrivals[:, :, :, self.depth + 1:].sum(axis=(2, 3))
+        material = (self.cyborgs * mine).sum(axis=1) - (self.cyborgs * theirs).sum(axis=1) + \
+            in_flight[:, 0] - in_flight[:, 1]
+        production = (self.rate * mine).sum(axis=1) - (self.rate * theirs).sum(axis=1)
+        return (material + self.rate_weight * production).astype(float)
+
+
+#################################################################################
+# Picks the best of several candidate move sets by rolling them forward together, within the turn's deadline
+class MoveSearch:
+    def __init__(self, model, transpositions=None, rollout_ms=SEARCH_ROLLOUT_MS):
+        self.__model = model
+        self.__transpositions = transpositions
+        self.rollout_ms = rollout_ms    # Estimated per candidate, measured again on every batch rolled out
+        self.evaluated = 0
+        self.candidates = 0
+        self.transposed = 0     # Candidates scored from the transposition table
+
+    # Scores of every move set, positions already in the transposition table are not rolled out again
+    def evaluate(self, move_sets):
+        rollout_timer = timer.start()
+        model = self.__model.batch(move_sets)
+        keys = model.hashes
+        scores = [None] * len(move_sets)
+        if self.__transpositions is not None:
+            scores = [self.__transpositions.get(key) for key in keys]
+            self.transposed += sum(score is not None for score in scores)
+        pending = [k for k, score in enumerate(scores) if score is None]
+        if not pending:
+            timer.clear(rollout_timer)
+            return scores
+        if len(pending) < len(move_sets):
+            model = model.take(pending)
+        self.evaluated += len(pending)
+        for k, score in zip(pending, model.rollout().tolist()):
+            scores[k] = score
+            if self.__transpositions is not None:
+                self.__transpositions.put(keys[k], score)
+        self.rollout_ms = timer.stop(rollout_timer) / len(pending)
+        return scores
+
+    # candidates[0] is the fallback, the others are rolled out in one batch as far as the deadline allows and
+    # have to beat it strictly. A fallback scored from the transposition table leaves the estimate as it came in.
+    def best(self, candidates, deadline):
+        self.candidates = len(candidates)
+        best_moves = candidates[0]
+        best_score = self.evaluate([best_moves])[0]
+        others = candidates[1:]
+        if deadline.remaining() < self.rollout_ms * len(others):
+            others = others[:max(0, int(deadline.remaining() / self.rollout_ms))]     # Not enough time for all
+        if others:
+            for moves, score in zip(others, self.evaluate(others)):
+                if score > best_score:
+                    best_moves, best_score = moves, score
+        return best_moves
+
+    def __str__(self):
+        return "search: {}/{} candidates, {} transposed".format(self.evaluated, self.candidates, self.transposed)
+
+
+#################################################################################
+# Successive shortest paths on a small graph with integer capacities. Edge k ^ 1 is the reverse of edge k, so the
+# flow on k is the residual capacity of k ^ 1. Flow pushed and edges added since mark() go with rollback().
+class MinCostFlow:
+    def __init__(self, num_nodes):
+        self.__adjacent = [[] for _ in range(num_nodes)]
+        self.__head = []
+        self.__capacity = []
+        self.__cost = []
+        self.__log = []     # (path edges, amount) per augmentation
+        self.cost = 0
+
+    def add_edge(self, u, v, capacity, cost):
+        k = len(self.__head)
+        self.__head += [v, u]
+        self.__capacity += [capacity, 0]
+        self.__cost += [cost, -cost]
+        self.__adjacent[u].append(k)
+        self.__adjacent[v].append(k + 1)
+        return k
+
+    def flow(self, k):
+        return self.__capacity[k ^ 1]
+
+    def mark(self):
+        return len(self.__log), len(self.__head)
+
+    def rollback(self, mark):
+        length, num_edges = mark
+        for edges, amount in reversed(self.__log[length:]):
+            for k in edges:
+                self.__capacity[k] += amount
+                self.__capacity[k ^ 1] -= amount
+                self.cost -= amount * self.__cost[k]
+        del self.__log[length:]
+        for k in range(len(self.__head) - 1, num_edges - 1, -1):
+            self.__adjacent[self.__head[k ^ 1]].pop()   # Edges were appended last, they come off the end
+        del self.__head[num_edges:], self.__capacity[num_edges:], self.__cost[num_edges:]
+
+    # Push up to limit units from s to t, cheapest paths first (SPFA, costs may be negative on reverse edges)
+    def push(self, s, t, limit):
+        pushed = 0
+        while pushed < limit:
+            dist = [math.inf] * len(self.__adjacent)
+            via = [-1] * len(self.__adjacent)
+            queued = [False] * len(self.__adjacent)
+            dist[s] = 0
+            queue = [s]
+            for u in queue:
+                queued[u] = False
+                for k in self.__adjacent[u]:
+                    v = self.__head[k]
+                    if self.__capacity[k] > 0 and dist[u] + self.__cost[k] < dist[v]:
+                        dist[v] = dist[u] + self.__cost[k]
+                        via[v] = k
+                        if not queued[v]:
+                            queued[v] = True
+                            queue.append(v)
+            if via[t] < 0:
+                break
+            edges = []
+            amount = limit - pushed
+            v = t
+            while v != s:
+                k = via[v]
+                edges.append(k)
+                amount = min(amount, self.__capacity[k])
+                v = self.__head[k ^ 1]
+            for k in edges:
+                self.__capacity[k] -= amount
+                self.__capacity[k ^ 1] += amount
+            self.cost += amount * dist[t]
+            self.__log.append((edges, amount))
+            pushed += amount
+        return pushed
+
+
+#################################################################################
+# Per-pair path costs and target scores kept across turns. Shortest paths are fixed after init, so an entry
+# only goes stale when a factory on its path changes, and GameState invalidates exactly those pairs.
+class PathCostCache:
+    def __init__(self):
+        self.__costs = {}       # (u,v) -> cyborgs on path
+        self.__scores = {}      # (u,v) -> target score
+        self.__dependents = {}  # factory -> {(u,v) whose path goes through it}
+        self.__registered = set()
+        self.__fresh = set()    # Pairs computed this turn, anything else that hits was reused
+        self.hits = 0
+        self.misses = 0
+        self.reused = 0
+        self.invalidated = 0
+
+    def __lookup(self, entries, u, v):
+        value = entries.get((u, v))
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            if (u, v) not in self.__fresh:
+                self.reused += 1
+        return value
+
+    def get(self, u, v):
+        return self.__lookup(self.__costs, u, v)
+
+    # path is the cached shortest path u->v, its factories after u are what the cost depends on
+    def put(self, u, v, cost, path):
+        if (u, v) not in self.__registered:
+            self.__registered.add((u, v))
+            for factory_id in set(path[1:]) | {v}:
+                self.__dependents.setdefault(factory_id, set()).add((u, v))
+        self.__costs[(u, v)] = cost
+        self.__fresh.add((u, v))
+
+    # Only valid for pairs whose cost is cached, they share the same dependencies
+    def get_score(self, u, v):
+        return self.__lookup(self.__scores, u, v)
+
+    def put_score(self, u, v, score):
+        self.__scores[(u, v)] = score
+
+    def invalidate(self, factory_ids):
+        for factory_id in factory_ids:
+            for pair in self.__dependents.get(factory_id, ()):
+                if self.__costs.pop(pair, None) is not None:
+                    self.invalidated += 1
+                self.__scores.pop(pair, None)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / float(lookups) if lookups else 0.0
+
+    # Called once per turn
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.reused = 0
+        self.invalidated = 0
+        self.__fresh.clear()
+
+    def __str__(self):
+        return "path cost cache: {}/{} hits ({:.0%}), {} reused from earlier turns, {} invalidated".format(
+            self.hits, self.hits + self.misses, self.hit_rate(), self.reused, self.invalidated)
+
+
+#################################################################################
+# Factory ids bucketed by (owner, production rate). GameState re-files a factory whenever either changes,
+# so filtered lists cost the size of the buckets they read instead of a scan of every factory.
+class FactoryIndex:
+    def __init__(self, factories):
+        self.__keys = {}        # id -> (owner, rate) bucket it is filed under
+        self.__buckets = {}     # (owner, rate) -> ids
+        for factory in factories.values():
+            self.__keys[factory.id] = (factory.owner, factory.cyborg_rate)
+            self.__buckets.setdefault(self.__keys[factory.id], set()).add(factory.id)
+
+    def update(self, factory):
+        key = (factory.owner, factory.cyborg_rate)
+        old = self.__keys[factory.id]
+        if key != old:
+            self.__buckets[old].discard(factory.id)
+            self.__buckets.setdefault(key, set()).add(factory.id)
+            self.__keys[factory.id] = key
+
+    # Ids in ascending order from every bucket whose (owner, rate) passes the filter
+    def select(self, accept):
+        ids = []
+        for (owner, rate), bucket in self.__buckets.items():
+            if bucket and accept(owner, rate):
+                ids.extend(bucket)
+        ids.sort()
+        return ids
+
+    # Producing factories, highest rate first and by id within a rate
+    def by_rate(self):
+        rates = sorted({rate for (_, rate), bucket in self.__buckets.items() if bucket and rate != 0}, reverse=True)
+        return [i for rate in rates for i in self.select(lambda owner, r: r == rate)]
 
 
 #################################################################################
@@ -270,15 +1251,30 @@ class PlayerStats:
 #################################################################################
 # Holds the game state
 class GameState:
-    def __init__(self, num_factories):
+    def __init__(self, num_factories, params=None):
+        self.params = Params() if params is None else params
         factory_range = range(num_factories)
         self.factories = {i: Factory(i) for i in factory_range}     # id -> Factory Node
         self.perceived_factories = {i: Factory(i) for i in factory_range}     # id -> Factory Node
-        self.troops = {}        # dst -> troop
-        self.bombs = []
+        self.factory_index = FactoryIndex(self.factories)
+        self.perceived_index = FactoryIndex(self.perceived_factories)
+        self.troops = EntityPool(Troop)
+        self.arrivals = ArrivalTimeline(num_factories)
+        self.bombs = EntityPool(Bomb)
         self.min_distances = MinFactoryDistances(num_factories)
+        self.graph = None       # GraphIndex, once the shortest paths are known
+        self.__undo = []        # (factories, id, owner, num_cyborgs) before each in-turn change, see snapshot()
         self.original_graph = [[(math.inf if m != n else 0) for n in factory_range] for m in factory_range]
-        self.future_commands = []
+        self.future_commands = CommandScheduler()
+        self.path_costs = PathCostCache()
+        self.threat = None
+        self.last_search = None
+        self.last_plan = None
+        self.rollout_ms = SEARCH_ROLLOUT_MS     # Per candidate, from the last move set rolled out
+        self.zobrist = Zobrist(num_factories)
+        self.transpositions = TranspositionTable()
+        self.__factory_hash = self.zobrist.empty     # Real factories, kept up to date by every change to them
+        self.__troop_hash = 0                       # Arrival slots of the troops in flight
 
         self.player_stats = {PLAYER_ID_SELF: PlayerStats(), PLAYER_ID_OPPONENT: PlayerStats()}
 
@@ -286,29 +1282,51 @@ class GameState:
         self.original_graph[u][v] = dist
         self.min_distances.create_edge(u, v, dist)
 
+    # Needs the shortest paths, locality is the sum of the distances to every reachable factory
     def calculate_locality(self):
-        factory_range = range(len(self.factories))
-        for u in factory_range:
-            for v in factory_range:
-                # self.factories[u].locality += self.get_edge(u, v)
-                # self.perceived_factories[u].locality += self.get_edge(u, v)
-                self.factories[u].locality += self.min_distances.get_distance(u, v)
-                self.perceived_factories[u].locality += self.min_distances.get_distance(u, v)
-
-    # Change the data for a given factory
+        self.graph = GraphIndex(self.min_distances.distances)
+        for u, locality in enumerate(self.graph.locality.tolist()):
+            self.factories[u].locality = locality
+            self.perceived_factories[u].locality = locality
+
+    # 64-bit hash of the real factories and the troops in flight, what ForwardModel starts its rollouts from
+    @property
+    def position_hash(self):
+        return (self.__factory_hash + self.__troop_hash) & HASH_MASK
+
+    # Reuse the links, shortest paths and graph index of another state on the same map, none of them change in-game
+    def share_topology(self, other):
+        self.original_graph = other.original_graph
+        self.min_distances = other.min_distances
+        self.graph = other.graph
+        for u, factory in other.factories.items():
+            self.factories[u].locality = factory.locality
+            self.perceived_factories[u].locality = factory.locality
+
+    # Change the data for a given factory, perceived state is copied over in calculate_perception
     def update_factory(self, factory_id, owner, num_cyborgs, cyborg_rate):
-        def helper(factory, o, n, r):
-            factory.owner = o
-            factory.num_cyborgs = n
-            factory.cyborg_rate = r
-
         if owner in self.player_stats:
             self.player_stats[owner].factories.append(factory_id)
             self.player_stats[owner].factory_cyborgs += num_cyborgs
             self.player_stats[owner].cyborg_rate += cyborg_rate
 
-        helper(self.factories[factory_id], owner, num_cyborgs, cyborg_rate)
-        helper(self.perceived_factories[factory_id], owner, num_cyborgs, cyborg_rate)
+        factory = self.factories[factory_id]
+        self.__rehash_factory(factory_id, owner, num_cyborgs, cyborg_rate)
+        factory.owner = owner
+        factory.num_cyborgs = num_cyborgs
+        factory.cyborg_rate = cyborg_rate
+        self.factory_index.update(factory)
+
+    # Swap a real factory's current values for the given ones in the position hash
+    def __rehash_factory(self, factory_id, owner, num_cyborgs, cyborg_rate):
+        factory = self.factories[factory_id]
+        old = self.zobrist.factory(factory_id, factory.owner, factory.num_cyborgs, factory.cyborg_rate)
+        new = self.zobrist.factory(factory_id, owner, num_cyborgs, cyborg_rate)
+        self.__factory_hash = (self.__factory_hash + new - old) & HASH_MASK
+
+    def reset_perception(self):
+        for factory_id in self.factories:
+            self.perceived_factories[factory_id].copy_from(self.factories[factory_id])
 
     def next_round(self):
         self.clear_troops()
@@ -317,7 +1335,9 @@ class GameState:
         self.player_stats[PLAYER_ID_OPPONENT].clear()
 
     def clear_troops(self):
+        self.__troop_hash = 0
         self.troops.clear()
+        self.arrivals.clear()
 
     def clear_bombs(self):
         self.bombs.clear()
@@ -325,25 +1345,21 @@ class GameState:
     # Change or add the data for a given troop
     def update_troop(self, troop_id, owner, num_cyborgs, src, dst, time_left):
         self.player_stats[owner].troop_cyborgs += num_cyborgs
-        troop = Troop(troop_id=troop_id,
-                      owner=owner,
-                      num_cyborgs=num_cyborgs,
-                      src=src,
-                      dst=dst,
-                      time_left=time_left)
-        if dst not in self.troops:
-            self.troops[dst] = {troop_id: troop}
-            return
-        self.troops[dst][troop_id] = troop
+        self.troops.acquire().set(troop_id, owner, num_cyborgs, src, dst, time_left)
+        self.__troop_hash = (self.__troop_hash + self.zobrist.arrival(owner, dst, time_left, num_cyborgs)) & HASH_MASK
+        self.arrivals.add(owner, dst, time_left, num_cyborgs)
 
     # Change or add the data for a given troop
     def update_bomb(self, bomb_id, owner, src, dst, time_left):
         self.player_stats[owner].bombs_sent.add(bomb_id)
-        bomb = Bomb(bomb_id,owner, src, dst, time_left)
-        self.bombs.append(bomb)
+        self.bombs.acquire().set(bomb_id, owner, src, dst, time_left)
 
     def update_after_move(self, src, dst, num_cyborgs):
+        previous = self.perceived_snapshot((src, dst))
+        self.__save(self.factories, (src,))
+        self.__save(self.perceived_factories, (src, dst))
         self.factories[src].num_cyborgs -= num_cyborgs
+        self.__factory_hash = (self.__factory_hash - self.zobrist.cyborgs(src, num_cyborgs)) & HASH_MASK
         self.perceived_factories[src].num_cyborgs -= num_cyborgs    # should be moving from self
         if self.perceived_factories[src].num_cyborgs < 0:
             self.perceived_factories[src].num_cyborgs *= -1
@@ -360,61 +1376,75 @@ class GameState:
             if self.perceived_factories[dst].num_cyborgs < 0:
                 self.perceived_factories[dst].owner = PLAYER_ID_SELF
                 self.perceived_factories[dst].num_cyborgs *= -1
+        self.mark_changed(previous)
 
     def calculate_perception(self):
-        for dst in self.troops:
-            # Sort and walk time-wise through troops
+        previous = self.perceived_snapshot()
+        self.reset_perception()
+        self.__undo = []    # Snapshots never reach back past a new turn
+        for dst in self.arrivals.destinations():
+            # Walk time-wise through the arrivals, troops landing on the same turn fight each other first
             factory = self.perceived_factories[dst]
-            troops = [self.troops[dst][troop_id] for troop_id in self.troops[dst]]
-            troops.sort(key=lambda t: t.time_left)
-
-            num_troops = len(troops)
-            num_skip = 0
             last_update = 0
-            for i in range(num_troops):
-                if num_skip > 0:
-                    num_skip -= 1
-                    continue
-                troop = troops[i]
-                delta = troop.num_cyborgs * troop.owner # delta w.r.t. me owning the factory
-                # if multiple troops arrive at the same time
-                for j in range(i+1, num_troops):
-                    if troops[j].time_left == troop.time_left:
-                        delta += troops[j].num_cyborgs * troop.owner
-                        num_skip += 1
-                    else:
-                        break
+            for time_left, mine, theirs in self.arrivals.arrivals(dst):
+                delta = mine - theirs   # delta w.r.t. me owning the factory
 
                 # If not neutral, generates troops
                 if factory.owner == PLAYER_ID_NEUTRAL:
                     factory.num_cyborgs -= abs(delta)
                 else:
                     delta *= factory.owner  # -troops = opponent won, but add them if opponent is owner, else subtract
-                    factory.num_cyborgs += factory.cyborg_rate*(troop.time_left-last_update)
+                    factory.num_cyborgs += factory.cyborg_rate*(time_left-last_update)
                     factory.num_cyborgs += delta
                 # Ownership change perceived
                 if factory.num_cyborgs < 0:
                     factory.num_cyborgs *= -1
                     if factory.owner == PLAYER_ID_NEUTRAL:
                         if delta != 0:
-                            factory.owner = delta / abs(delta)
+                            factory.owner = PLAYER_ID_SELF if delta > 0 else PLAYER_ID_OPPONENT
                     else:
                         factory.owner *= -1
-                last_update = troop.time_left
-
-    def add_future_command(self, src, dst, time_left):
-        self.future_commands.append(Command(src, dst, time_left))
-        self.update_perception_after_future_command(src, dst)
-
-    def set_future_command(self, index, src, time_left):
-        self.future_commands[index].src = src
-        self.future_commands[index].time_left = time_left
-        self.update_perception_after_future_command(src, self.future_commands[index].dst)
-
-    def update_perception_after_future_command(self, src, dst):
+                last_update = time_left
+        self.mark_changed(previous)
+
+    # What path costs and target scores read from a factory, cyborgs in my own factories don't count
+    @staticmethod
+    def path_key(factory):
+        return factory.owner, (factory.num_cyborgs if factory.owner != PLAYER_ID_SELF else 0), factory.cyborg_rate
+
+    def perceived_snapshot(self, factory_ids=None):
+        if factory_ids is None:
+            factory_ids = self.perceived_factories
+        return {i: self.path_key(self.perceived_factories[i]) for i in factory_ids}
+
+    # Mark the factories whose perceived state differs from a perceived_snapshot(), every change to the perceived
+    # factories ends here so it also keeps their index current
+    def mark_changed(self, snapshot):
+        changed = [i for i, before in snapshot.items() if self.path_key(self.perceived_factories[i]) != before]
+        for i in changed:
+            self.perceived_index.update(self.perceived_factories[i])
+        self.mark_dirty(changed)
+
+    # Perceived state of these factories changed, drop the cached pairs going through them
+    def mark_dirty(self, factory_ids):
+        self.path_costs.invalidate(factory_ids)
+
+    def add_future_command(self, src, dst, time_left, num_cyborgs=None):
+        self.future_commands.schedule(Command(src, dst, num_cyborgs), time_left)
+        self.update_perception_after_future_command(src, dst, num_cyborgs)
+
+    # Move a dispatched command on to its next hop
+    def reschedule_future_command(self, cmd, src, time_left):
+        cmd.src = src
+        self.future_commands.schedule(cmd, time_left)
+        self.update_perception_after_future_command(src, cmd.dst, cmd.num_cyborgs)
+
+    def update_perception_after_future_command(self, src, dst, num_cyborgs=None):
         # Update perception as if we went through the full path already
         path = self.min_distances.get_cached_path(src, dst)
-        cyborgs_needed = self.cyborgs_on_path(path, self.perceived_factories) + 1
+        cyborgs_needed = self.cyborgs_on_perceived_path(src, dst) + 1 if num_cyborgs is None else num_cyborgs
+        previous = self.perceived_snapshot(path)
+        self.__save(self.perceived_factories, path)
         global turn
         for k in range(1, len(path)):
             dist = self.get_edge(path[k-1], path[k])
@@ -440,39 +1470,62 @@ class GameState:
                 if next_factory.num_cyborgs < 0:
                     next_factory.owner = PLAYER_ID_SELF
                     next_factory.num_cyborgs *= -1      # make positive # cyborgs again
-                else:
+                elif num_cyborgs is None:   # A share alone is not meant to take it
                     print("Error! num cyborgs ({}) at {} !< 0! Command({}, {}), Path: {}".format(next_factory.num_cyborgs, path[k], src, dst, path), file=sys.stderr)
+        self.mark_changed(previous)
+
+    def __save(self, factories, factory_ids):
+        for i in factory_ids:
+            self.__undo.append((factories, i, factories[i].owner, factories[i].num_cyborgs))
+
+    # Moves issued after this point can be undone with rollback(), the cost is the factories they touch
+    def snapshot(self):
+        return len(self.__undo), self.future_commands.mark()
+
+    def rollback(self, snapshot):
+        length, num_commands = snapshot
+        undone = self.__undo[length:]
+        previous = self.perceived_snapshot({i for factories, i, _, _ in undone if factories is self.perceived_factories})
+        for factories, i, owner, num_cyborgs in reversed(undone):
+            if factories is self.factories:
+                self.__rehash_factory(i, owner, num_cyborgs, factories[i].cyborg_rate)
+            factories[i].owner = owner
+            factories[i].num_cyborgs = num_cyborgs
+            if factories is self.factories:
+                self.factory_index.update(factories[i])
+        del self.__undo[length:]
+        self.future_commands.rollback(num_commands)
+        self.mark_changed(previous)
+
+    # Try moves on the perceived state and undo them on exit:  with state.what_if(): issue_move(...)
+    @contextlib.contextmanager
+    def what_if(self):
+        snapshot = self.snapshot()
+        try:
+            yield self
+        finally:
+            self.rollback(snapshot)
 
-    # Update all future commands
     def tick_commands(self):
-        for cmd in self.future_commands:
-            cmd.time_left -= 1
-
-    # Remove None commands
-    def prune_commands(self):
-        self.future_commands = [cmd for cmd in self.future_commands if cmd]
+        self.future_commands.tick()
 
     # Get all factories that a player owns
     def get_player_factories(self, player_id):
         if player_id in self.player_stats:
             return self.player_stats[player_id].factories
-        return [factory_id for factory_id in self.factories if self.factories[factory_id].owner == PLAYER_ID_NEUTRAL]
+        return self.factory_index.select(lambda owner, rate: owner == PLAYER_ID_NEUTRAL)
 
     def get_sorted_factory_list(self):
-        return sorted([factory for factory in self.factories if self.factories[factory].cyborg_rate != 0],
-                      key=lambda x: self.factories[x].cyborg_rate, reverse=True)
+        return self.factory_index.by_rate()
 
     def get_target_factory_list(self, factories=None):
-        if factories is None:
-            factories = self.factories
-        return [factory for factory in factories if factories[factory].cyborg_rate != 0
-                and factories[factory].owner != PLAYER_ID_SELF]
+        return self.__index_of(factories).select(lambda owner, rate: rate != 0 and owner != PLAYER_ID_SELF)
 
     def get_compliment_filtered_list(self, factories=None):
-        if factories is None:
-            factories = self.factories
-        return [factory for factory in factories if factories[factory].cyborg_rate == 0
-                and factories[factory].owner != PLAYER_ID_SELF]
+        return self.__index_of(factories).select(lambda owner, rate: rate == 0 and owner != PLAYER_ID_SELF)
+
+    def __index_of(self, factories):
+        return self.perceived_index if factories is self.perceived_factories else self.factory_index
 
     def cyborgs_on_path(self, path, factories=None):
         if factories is None:
@@ -490,208 +1543,433 @@ class GameState:
                 troops += factories[path[k]].cyborg_rate*(dist+1)
         return int(troops)
 
+    # cyborgs_on_path for the shortest path u->v through perceived_factories, cached until a factory on it changes
+    def cyborgs_on_perceived_path(self, u, v):
+        cost = self.path_costs.get(u, v)
+        if cost is None:
+            path = self.min_distances.get_cached_path(u, v)
+            cost = self.cyborgs_on_path(path, self.perceived_factories)
+            self.path_costs.put(u, v, cost, path)
+        return cost
+
     def get_edge(self, u, v):
         return self.original_graph[u][v]
 
 turn = 0
 
 
-def init():
-    factory_count = int(input())  # the number of factories
-    link_count = int(input())  # the number of links between factories
+def init(reader, seed=None, params=None, recorder=None):
+    factory_count = reader.read_int()  # the number of factories
+    link_count = reader.read_int()  # the number of links between factories
+    links = reader.read_table(link_count, 3)
+    if recorder is not None:
+        recorder.start_game(factory_count, links)
+    return init_state(factory_count, links, seed, params)
+
+
+# Build the state from decoded (factory_1, factory_2, distance) links and precompute routing
+def init_state(factory_count, links, seed=None, params=None):
     init_timer = timer.start()
 
-    state = GameState(factory_count)
-    msg_generator = MessageGenerator()
+    state = GameState(factory_count, Params.load() if params is None else params)
+    msg_generator = MessageGenerator(seed=seed)
 
-    for i in range(link_count):
-        factory_1, factory_2, distance = [int(j) for j in input().split()]
+    for factory_1, factory_2, distance in links.tolist():
         state.create_edge(factory_1, factory_2, distance)
         state.create_edge(factory_2, factory_1, distance)       # Undirected
 
-    state.calculate_locality()
-    state.min_distances.calculate()
-    state.min_distances.cache_all_paths()
+    with telemetry.span("distances"):
+        state.min_distances.calculate()
+    with telemetry.span("graph"):
+        state.calculate_locality()
 
     d = timer.stop(init_timer)
-    print("{:.2f} ms spent initializing".format(d.microseconds / 1000.0), file=sys.stderr)
+    print("{:.2f} ms spent initializing".format(d), file=sys.stderr)
     return state, msg_generator
 
 
-def game_loop(state, msg_generator):
-    loop_timer = timer.reserve_id()
-    # game loop
-    while True:
-        global turn
-        turn += 2   # for me and opponenet
-        game_cmd = "MSG {}".format(msg_generator.get())
-
-        state.next_round()
-
-        entity_count = int(input())  # the number of entities (e.g. factories and troops)
-        for i in range(entity_count):
-            line = input()
-            entity_id, entity_type, arg_1, arg_2, arg_3, arg_4, arg_5 = line.split()
-            entity_id = int(entity_id)
-            arg_1 = int(arg_1)
-            arg_2 = int(arg_2)
-            arg_3 = int(arg_3)
-            arg_4 = int(arg_4)
-            arg_5 = int(arg_5)
-
-            if entity_type == "FACTORY":
-                state.update_factory(entity_id, owner=arg_1, num_cyborgs=arg_2, cyborg_rate=arg_3)
-            elif entity_type == "TROOP":
-                state.update_troop(troop_id=entity_id,
-                                   owner=arg_1,
-                                   num_cyborgs=arg_4,
-                                   src=arg_2,
-                                   dst=arg_3,
-                                   time_left=arg_5)
-            elif entity_type == "BOMB":
-                state.update_bomb(bomb_id=entity_id, owner=arg_1, src=arg_2, dst=arg_3, time_left=arg_4)
+# Read one turn's entity block straight into the state, returns the decoded block
+def read_turn(state, reader):
+    entities = reader.read_entities()
+    load_turn(state, entities)
+    return entities
+
+
+# Dispatch decoded entity rows into the state
+def load_turn(state, entities):
+    state.next_round()
+
+    for entity_id, entity_type, arg_1, arg_2, arg_3, arg_4, arg_5 in entities.tolist():
+        if entity_type == ENTITY_FACTORY:
+            state.update_factory(entity_id, owner=arg_1, num_cyborgs=arg_2, cyborg_rate=arg_3)
+        elif entity_type == ENTITY_TROOP:
+            state.update_troop(troop_id=entity_id,
+                               owner=arg_1,
+                               num_cyborgs=arg_4,
+                               src=arg_2,
+                               dst=arg_3,
+                               time_left=arg_5)
+        elif entity_type == ENTITY_BOMB:
+            state.update_bomb(bomb_id=entity_id, owner=arg_1, src=arg_2, dst=arg_3, time_left=arg_4)
+
+
+# Send num_cyborgs from src towards dst, relaying through the factories on the shortest path. Less than the path
+# needs over a route of my own factories is one share of a split attack, the relays pass on just that share.
+def issue_move(state, plan, src, dst, num_cyborgs):
+    path = state.min_distances.get_cached_path(src, dst)
+    share = None
+    if num_cyborgs <= state.cyborgs_on_perceived_path(src, dst) and owned_route(state, src, dst):
+        share = num_cyborgs
+    state.update_after_move(src, path[1], num_cyborgs)
+    if len(path) > 2:
+        state.add_future_command(src=path[1], dst=dst, time_left=state.get_edge(src, path[1]), num_cyborgs=share)
+    plan.move(src, path[1], num_cyborgs, target=dst)
+
+
+# Stage 0: relay hops that earlier turns already committed to
+def dispatch_future_commands(state, plan):
+    # Due commands are off the wheel, the ones that go on are scheduled again
+    for cmd in state.future_commands.pop_due():
+        path = state.min_distances.get_cached_path(cmd.src, cmd.dst)
+        cyborgs_needed = state.cyborgs_on_perceived_path(cmd.src, cmd.dst) + 1 if cmd.num_cyborgs is None \
+            else cmd.num_cyborgs
+        factory_cyborgs = min(state.factories[cmd.src].num_cyborgs,
+                              state.perceived_factories[cmd.src].num_cyborgs)
+
+        if state.factories[cmd.src].owner == PLAYER_ID_OPPONENT:
+            continue
+        elif state.factories[cmd.src].owner == PLAYER_ID_NEUTRAL:
+            state.future_commands.schedule(cmd, 1)      # Delay an extra round if miscalculated....
+            continue
+        if factory_cyborgs >= cyborgs_needed:
+            plan.move(cmd.src, path[1], cyborgs_needed, target=cmd.dst)
+            state.update_after_move(cmd.src, path[1], cyborgs_needed)
+            if len(path) > 2:
+                state.reschedule_future_command(cmd, path[1], state.get_edge(cmd.src, path[1]))
+
+
+# Cyborgs src can still send this turn: what it has now, what it is perceived to keep,
+# and what the threat map leaves after the moves already planned from it
+def spare_cyborgs(state, plan, src):
+    return min(state.factories[src].num_cyborgs, state.perceived_factories[src].num_cyborgs,
+               int(state.threat.surplus[src]) - plan.spent(src))
+
+
+# Lower is better: distance plus cyborgs to beat on the way, per unit of production gained
+def target_score(state, src, dst):
+    params = state.params
+    cyborgs = state.cyborgs_on_perceived_path(src, dst) + 1
+    cost = state.path_costs.get_score(src, dst)
+    if cost is None:
+        rate = state.perceived_factories[dst].cyborg_rate
+        cost = state.min_distances.get_distance(src, dst)
+        if rate != 0:
+            cost = (params.target_distance_weight * cost + params.target_cyborg_weight * cyborgs) / float(rate)
+        state.path_costs.put_score(src, dst, cost)
+    return cost
+
+
+# Targets of src cheapest first, evaluated lazily in distance order: a target is yielded once no factory
+# further away can score lower, so the caller can stop as soon as src runs out of cyborgs.
+# Only targets affordable when they are reached are considered.
+def ranked_targets(state, plan, src, targets):
+    params = state.params
+    w_d, w_c = params.target_distance_weight, params.target_cyborg_weight
+    heap = []
+    for dist, dst in state.graph.neighbors(src):
+        if dst not in targets:
+            continue
+        # Scores only grow with distance and cyborgs and shrink with rate, unless a weight is negative
+        bound = min(dist, (w_d * dist + w_c) / float(MAX_RATE)) if w_d >= 0 and w_c >= 0 else -math.inf
+        while heap and heap[0][0] < bound:
+            yield heapq.heappop(heap)[1]
+        if state.cyborgs_on_perceived_path(src, dst) + 1 <= spare_cyborgs(state, plan, src):
+            heapq.heappush(heap, (target_score(state, src, dst), dst))
+    while heap:
+        yield heapq.heappop(heap)[1]
+
+
+# Stage 1: greedy target selection per source, stops between sources once the deadline is hit
+def plan_targets(state, my_factories, deadline, plan):
+    my_factories.sort(key=lambda x: state.factories[x].locality)
+    mean_locality = sum([state.factories[f].locality for f in my_factories]) / float(len(my_factories))
+    params = state.params
+
+    for i in range(len(my_factories)):
+        if deadline.expired():
+            break
+
+        filtered_list = state.get_target_factory_list(state.perceived_factories)
+        if not filtered_list:
+            filtered_list = state.get_compliment_filtered_list(state.perceived_factories)
+
+        # Get the current factory object vs. perceived
+        src_factory = state.factories[my_factories[i]]
+
+        # Don't move from here if we're not perceived to own it
+        if state.perceived_factories[src_factory.id].owner != PLAYER_ID_SELF:
+            continue
 
-        timer.start(loop_timer)
+        # Take the best targets while cyborgs last, don't move if we're going to lose it
+        has_targets = False
+        for target_id in ranked_targets(state, plan, src_factory.id, set(filtered_list)):
+            has_targets = True
+            path = state.min_distances.get_cached_path(u=src_factory.id, v=target_id)
+            if len(path) < 2:
+                print("Path ({},{}) too short! {}".format(src_factory.id, target_id, path), file=sys.stderr)
+                continue
+            cyborgs_needed = state.cyborgs_on_perceived_path(src_factory.id, target_id) + 1
+            factory_cyborgs = spare_cyborgs(state, plan, src_factory.id)
+            if cyborgs_needed <= factory_cyborgs:
+                issue_move(state, plan, src_factory.id, target_id, cyborgs_needed)
+            if spare_cyborgs(state, plan, src_factory.id) < 1:
+                break   # Nothing is cheaper than one cyborg
+
+        if not has_targets and i > 0 and src_factory.locality > mean_locality * params.reinforce_locality_factor:
+            with telemetry.span("reinforce"):
+                factory_cyborgs = spare_cyborgs(state, plan, src_factory.id)
+                num_cyborgs = math.ceil(factory_cyborgs * params.reinforce_fraction)
+                next_factory = int(i / 2)
 
-        state.calculate_perception()
-        state.tick_commands()
-
-        # Check commands to execute
-        for i in range(len(state.future_commands)):
-            cmd = state.future_commands[i]
-            if cmd.time_left <= 0:
-                path = state.min_distances.get_cached_path(cmd.src, cmd.dst)
-                cyborgs_needed = state.cyborgs_on_path(path, state.perceived_factories) + 1
-                factory_cyborgs = min(state.factories[cmd.src].num_cyborgs,
-                                      state.perceived_factories[cmd.src].num_cyborgs)
-
-                if state.factories[cmd.src].owner == PLAYER_ID_OPPONENT:
-                    state.future_commands[i] = None
-                    continue
-                elif state.factories[cmd.src].owner == PLAYER_ID_NEUTRAL:
-                    continue        # Delay an extra round if miscalculated....
-                if factory_cyborgs >= cyborgs_needed:
-                    game_cmd += ";{} {} {} {}".format(CMD_MOVE, cmd.src, path[1], cyborgs_needed)
-                    state.update_after_move(cmd.src, path[1], cyborgs_needed)
-                    if len(path) > 2:
-                        state.set_future_command(i, path[1], state.get_edge(cmd.src, path[1]))
+                if num_cyborgs > 0:
+                    path = state.min_distances.get_cached_path(u=src_factory.id, v=my_factories[next_factory])
+                    if len(path) < 2:
+                        print("2Path ({},{}) too short! {}".format(src_factory.id, my_factories[next_factory], path), file=sys.stderr)
                     else:
-                        state.future_commands[i] = None
-                else:
-                    state.future_commands[i] = None
+                        issue_move(state, plan, src_factory.id, my_factories[next_factory], num_cyborgs)
+
+
+# Stage 2: bombs on the opponent's best factories
+def plan_bombs(state, plan):
+    bombs_available = MAX_BOMBS - state.player_stats[PLAYER_ID_SELF].num_bombs_sent()
+    enemy_factories = state.player_stats[PLAYER_ID_OPPONENT].factories
+    if bombs_available > 0 and enemy_factories:
+        mean_rate = state.player_stats[PLAYER_ID_OPPONENT].cyborg_rate / float(len(enemy_factories))
+        if mean_rate > 0:
+            mean_cyborgs = (state.player_stats[PLAYER_ID_OPPONENT].factory_cyborgs
+                            + state.player_stats[PLAYER_ID_OPPONENT].troop_cyborgs) / float(len(enemy_factories))
+            en_route_targets = {x.dst for x in state.bombs if x.owner == PLAYER_ID_SELF}
+
+            for bomb_target_id in enemy_factories:
+                if bomb_target_id in en_route_targets:
+                    continue
 
-        state.prune_commands()
+                target_factory = state.perceived_factories[bomb_target_id]
+                if (target_factory.cyborg_rate >= mean_rate * state.params.bomb_rate_factor
+                        and target_factory.num_cyborgs >= mean_cyborgs * state.params.bomb_cyborg_factor):
+                    # Send bomb from the closest factory not already sending cyborgs there
+                    possible_sources = [x for x in state.player_stats[PLAYER_ID_SELF].factories
+                                        if not plan.has_move(x, bomb_target_id)]
+                    if len(possible_sources):
+                        source = min(possible_sources, key=lambda x: state.get_edge(x, bomb_target_id))
+                        plan.bomb(source, bomb_target_id)
+                        bombs_available -= 1
+                        if bombs_available == 0:
+                            break
+
+
+# Cyborgs that win dst when they all land by turn t, from the perceived garrison and production
+def attack_need(factory, t):
+    need = factory.num_cyborgs + 1
+    if factory.owner == PLAYER_ID_OPPONENT:
+        need += factory.cyborg_rate * (t + 1)
+    return need
+
+
+# Every factory between src and dst is perceived mine, so a share sent from src can be relayed on as it is
+def owned_route(state, src, dst):
+    path = state.min_distances.get_cached_path(src, dst)
+    return all(state.perceived_factories[f].owner == PLAYER_ID_SELF for f in path[1:-1])
+
+
+# Every target at once, including those no single source can afford: sources send along min-cost flow edges
+# weighted by distance, each target's demand is what it takes at the latest arrival it allows. Targets are added
+# in score order and kept only if the whole demand flows, earlier targets may be re-routed to make room.
+def allocate_attacks(state, plan, my_factories):
+    params = state.params
+    perceived = state.perceived_factories
+    supply = {src: spare_cyborgs(state, plan, src) for src in my_factories if perceived[src].owner == PLAYER_ID_SELF}
+    supply = {src: n for src, n in supply.items() if n > 0}
+    if not supply:
+        return []
+
+    # Arrival windows: a target is reachable by turn t from the sources within t, relayed by my factories only
+    windows = []
+    for dst in state.get_target_factory_list(perceived):
+        factory = perceived[dst]
+        sources = [(dist, src) for dist, src in state.graph.neighbors(dst) if src in supply
+                   and state.cyborgs_on_perceived_path(src, dst) + 1 == attack_need(factory, dist)
+                   and owned_route(state, src, dst)]
+        total = 0
+        for k, (dist, src) in enumerate(sources):
+            total += supply[src]
+            if total >= attack_need(factory, dist) and (k + 1 == len(sources) or sources[k + 1][0] > dist):
+                score = (params.target_distance_weight * dist +
+                         params.target_cyborg_weight * attack_need(factory, dist)) / float(factory.cyborg_rate)
+                windows.append((score, dst, sources, k))
+                break
+    windows.sort()
+
+    # One node per factory plus the source, each target is the sink while its demand is pushed. Without a shared
+    # sink the flow kept by earlier targets can be re-routed between sources but never taken from them.
+    source_node = len(state.factories)
+    flow = MinCostFlow(source_node + 1)
+    for src, n in supply.items():
+        flow.add_edge(source_node, src, n, 0)
+    routes = []     # (edge, src, dst) per source-target edge kept
+    for _, dst, sources, k in windows:
+        distances = sorted({dist for dist, _ in sources[k:]})[:ALLOCATION_WINDOWS]
+        for window in distances:
+            mark = flow.mark()
+            added = [(flow.add_edge(src, dst, supply[src], dist), src, dst) for dist, src in sources if dist <= window]
+            need = attack_need(perceived[dst], window)
+            if flow.push(source_node, dst, need) == need:
+                routes += added
+                break
+            flow.rollback(mark)
+    return [(src, dst, flow.flow(k)) for k, src, dst in routes if flow.flow(k) > 0]
 
-        my_factories = state.get_player_factories(PLAYER_ID_SELF)
-        if not my_factories:
-            print("WAIT")
-            continue
 
-        ################################################################################
-        my_factories.sort(key=lambda x: state.factories[x].locality)
-        mean_locality = sum([state.factories[f].locality for f in my_factories]) / float(len(my_factories))
+# Alternatives to the greedy move set: one source sends everything to its best affordable target.
+# Holding back or dropping single greedy moves was tried, rollouts overrate passive play and it lost games.
+def generate_candidates(state, plan, greedy_moves, my_factories):
+    candidates = [greedy_moves]
 
-        for i in range(len(my_factories)):
-            filtered_list = state.get_target_factory_list(state.perceived_factories)
-            if not filtered_list:
-                filtered_list = state.get_compliment_filtered_list(state.perceived_factories)
+    allocated = allocate_attacks(state, plan, my_factories)
+    if allocated:
+        used = {src for src, _, _ in allocated} | {dst for _, dst, _ in allocated}
+        candidates.append(allocated + [move for move in greedy_moves if move[0] not in used and move[1] not in used])
 
-            # Get the current factory object vs. perceived
-            src_factory = state.factories[my_factories[i]]
+    targets = state.get_target_factory_list(state.perceived_factories)
+    for src in my_factories:
+        if state.perceived_factories[src].owner != PLAYER_ID_SELF:
+            continue
+        available = spare_cyborgs(state, plan, src)
+        reachable = {dst for _, dst in state.graph.neighbors(src)}     # No path costs nothing, like ranked_targets
+        affordable = [(state.cyborgs_on_perceived_path(src, dst) + 1, dst) for dst in targets if dst in reachable]
+        affordable = [(needed, dst) for needed, dst in affordable if needed <= available]
+        if affordable:
+            needed, dst = min(affordable, key=lambda x: target_score(state, src, x[1]))
+            candidates.append([move for move in greedy_moves if move[0] != src] + [(src, dst, available)])
+
+    unique = []
+    seen = set()
+    for moves in candidates:
+        key = tuple(sorted(moves))
+        if key not in seen:
+            seen.add(key)
+            unique.append(moves)
+    return unique[:SEARCH_MAX_CANDIDATES]
+
+
+# Stage 1b: keep the greedy moves unless a rollout finds a better move set
+def search_moves(state, plan, model, snapshot, mark, my_factories, deadline):
+    search = MoveSearch(model, state.transpositions, state.rollout_ms)
+    greedy_moves = plan.moves(mark)
+    state.rollback(snapshot)    # Candidates are built from the state the greedy planner started from
+    plan.rollback(mark)
+    candidates = generate_candidates(state, plan, greedy_moves, my_factories)
+    best_moves = search.best(candidates, deadline)
+    state.rollout_ms = search.rollout_ms
+    for src, dst, num_cyborgs in best_moves:
+        issue_move(state, plan, src, dst, num_cyborgs)
+    return search
+
+
+# Decide one turn on an already parsed state, returns the command string.
+# A valid command is ready after each stage, later stages only run while the deadline allows.
+def play_turn(state, msg_generator, deadline=None):
+    if deadline is None:
+        deadline = Deadline()
+
+    plan = ActionPlan({f.id: f.num_cyborgs for f in state.factories.values() if f.owner == PLAYER_ID_SELF})
+    plan.message = msg_generator.get()
+    state.last_search = None
+
+    state.last_plan = plan
+    state.transpositions.new_turn()
+    with telemetry.span("perception"):
+        state.calculate_perception()
+        state.threat = ThreatMap(state, state.params.threat_weight)
+    state.tick_commands()
+    model = ForwardModel(state, state.params.search_depth, state.params.search_rate_weight)
+    with telemetry.span("dispatch"):
+        dispatch_future_commands(state, plan)
+    for src, dst, num_cyborgs in plan.moves():
+        model.send(PLAYER_ID_SELF, src, dst, num_cyborgs)
+
+    my_factories = state.get_player_factories(PLAYER_ID_SELF)
+    if not my_factories:
+        return CMD_WAIT
+
+    snapshot = state.snapshot()
+    mark = plan.mark()
+    with telemetry.span("targets"):
+        plan_targets(state, my_factories, deadline, plan)
+    if deadline.expired():
+        return str(plan)
+
+    with telemetry.span("search"):
+        state.last_search = search_moves(state, plan, model, snapshot, mark, my_factories, deadline)
+    if not deadline.expired():
+        with telemetry.span("bombs"):
+            plan_bombs(state, plan)
+    return str(plan)
+
+
+# Counters for telemetry.end_turn() after play_turn
+def turn_counters(state):
+    plan = state.last_plan
+    return {"paths_evaluated": state.path_costs.misses,
+            "cache_hits": state.path_costs.hits,
+            "cache_reused": state.path_costs.reused,
+            "moves": len(plan.moves()) if plan is not None else 0,
+            "actions": len(plan) if plan is not None else 0,
+            "rollouts": state.last_search.evaluated if state.last_search is not None else 0,
+            "transposed": state.last_search.transposed if state.last_search is not None else 0}
+
+
+def game_loop(state, msg_generator, reader, recorder=None):
+    loop_timer = timer.reserve_id()
+    # game loop
+    while True:
+        global turn
+        turn += 2   # for me and opponenet
 
-            # Don't move from here if we're not perceived to own it
-            if state.perceived_factories[src_factory.id].owner != PLAYER_ID_SELF:
-                continue
+        telemetry.start_turn()
+        try:
+            with telemetry.span("parse"):
+                entities = read_turn(state, reader)
+        except EOFError:
+            if recorder is not None:
+                recorder.end_game()
+            telemetry.close()
+            return      # End of a piped replay
 
-            # Find the closest targets
-            valid_targets = []
-            factory_cyborgs = min(state.factories[src_factory.id].num_cyborgs,
-                                  state.perceived_factories[src_factory.id].num_cyborgs)
-            for factory_id in filtered_list:
-                path = state.min_distances.get_cached_path(src_factory.id, factory_id)
-                cyborgs_needed = state.cyborgs_on_path(path, state.perceived_factories) + 1
-                # Don't move if we're going to lose it
-                if cyborgs_needed <= factory_cyborgs:
-                    valid_targets.append(factory_id)
-
-            def weighted_distance(target):
-                rate = state.perceived_factories[target].cyborg_rate
-                cost = state.min_distances.get_distance(src_factory.id, target)
-                shortest_path = state.min_distances.get_cached_path(u=src_factory.id, v=target)
-                cyborgs = state.cyborgs_on_path(shortest_path, state.perceived_factories) + 1
-                if rate != 0:
-                    cost = (cost + cyborgs) / float(rate)
-                return cost
-
-            if len(valid_targets) > 0:
-                valid_targets.sort(key=weighted_distance)
-                for target_id in valid_targets:
-                    path = state.min_distances.get_cached_path(u=src_factory.id, v=target_id)
-                    if len(path) < 2:
-                        print("Path ({},{}) too short! {}".format(src_factory.id, target_id, path), file=sys.stderr)
-                        continue
-                    else:
-                        cyborgs_needed = state.cyborgs_on_path(path, state.perceived_factories) + 1
-                        factory_cyborgs = min(state.factories[src_factory.id].num_cyborgs,
-                                              state.perceived_factories[src_factory.id].num_cyborgs)
-                        if cyborgs_needed <= factory_cyborgs:
-                            game_cmd += ";MOVE {} {} {}".format(src_factory.id, path[1], cyborgs_needed)
-                            state.update_after_move(src_factory.id, path[1], cyborgs_needed)
-                            if len(path) > 2:
-                                state.add_future_command(src=path[1],
-                                                         dst=target_id,
-                                                         time_left=state.get_edge(src_factory.id, path[1]))
-            elif i > 0 and src_factory.locality > mean_locality:
-                factory_cyborgs = min(state.factories[src_factory.id].num_cyborgs,
-                                      state.perceived_factories[src_factory.id].num_cyborgs)
-                num_cyborgs = math.ceil(factory_cyborgs / 2)
-                next_factory = int(i / 2)
+        timer.start(loop_timer)
+        state.path_costs.reset_stats()
+        deadline = Deadline(loop_timer, FIRST_TURN_BUDGET_MS if turn == 2 else TURN_BUDGET_MS)
 
-                if num_cyborgs > 0:
-                    path = state.min_distances.get_cached_path(u=src_factory.id, v=my_factories[next_factory])
-                    if len(path) < 2:
-                        print("2Path ({},{}) too short! {}".format(src_factory.id, my_factories[next_factory], path), file=sys.stderr)
-                    else:
-                        game_cmd += ";MOVE {} {} {}".format(src_factory.id, path[1], num_cyborgs)
-                        state.update_after_move(src_factory.id, path[1], num_cyborgs)
-                        if len(path) > 2:
-                            state.add_future_command(src=path[1],
-                                                     dst=my_factories[next_factory],
-                                                     time_left=state.get_edge(src_factory.id, path[1]))
-
-        bombs_available = MAX_BOMBS - state.player_stats[PLAYER_ID_SELF].num_bombs_sent()
-        if bombs_available > 0:
-            enemy_factories = state.player_stats[PLAYER_ID_OPPONENT].factories
-            mean_rate = state.player_stats[PLAYER_ID_OPPONENT].cyborg_rate / float(len(enemy_factories))
-            if mean_rate > 0:
-                mean_cyborgs = (state.player_stats[PLAYER_ID_OPPONENT].factory_cyborgs
-                                + state.player_stats[PLAYER_ID_OPPONENT].troop_cyborgs) / float(len(enemy_factories))
-                en_route_targets = {x.dst for x in state.bombs if x.owner == PLAYER_ID_SELF}
-
-                for bomb_target_id in enemy_factories:
-                    if bomb_target_id in en_route_targets:
-                        continue
-
-                    target_factory = state.perceived_factories[bomb_target_id]
-                    if target_factory.cyborg_rate >= mean_rate and target_factory.num_cyborgs >= mean_cyborgs:
-                        # Send bomb
-                        possible_sources = [x for x in state.player_stats[PLAYER_ID_SELF].factories
-                                            if "MOVE {} {}".format(x, bomb_target_id) not in game_cmd]
-                        if len(possible_sources):
-                            source = min(state.player_stats[PLAYER_ID_SELF].factories,
-                                         key=lambda x: state.get_edge(x, bomb_target_id))
-                            game_cmd += ";BOMB {} {}".format(source, bomb_target_id)
-                            bombs_available -= 1
-                            if bombs_available == 0:
-                                break
-
-        print(game_cmd)
+        game_cmd = play_turn(state, msg_generator, deadline)
+        print(game_cmd, flush=True)     # Block-buffered on the referee's pipe, nothing else flushes it
         d = timer.delta(loop_timer)
-        print("{:.2f} ms spent on turn {}".format(d.microseconds / 1000.0, turn), file=sys.stderr)
+        print("{:.2f} ms spent on turn {} ({:.2f} ms left), {}, {}".format(d, turn, deadline.remaining(),
+                                                                            state.path_costs, state.last_search),
+              file=sys.stderr)
+        telemetry.end_turn(**turn_counters(state))
+        if recorder is not None:
+            recorder.record_turn(entities, game_cmd)
 
 
 def main():
-    state, msg_generator = init()
-    game_loop(state, msg_generator)
+    recorder = None
+    if os.environ.get("GITC_RECORD"):
+        import replay   # Offline only, the arena just gets this file
+        recorder = replay.ReplayRecorder(os.environ["GITC_RECORD"])
+
+    reader = InputReader()
+    state, msg_generator = init(reader, recorder=recorder)
+    game_loop(state, msg_generator, reader, recorder)
 
-main()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+
+import referee
+import test as bot
+
+CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tune_cache.json")
+
+# name -> (low, high, mutation sigma), integer parameters are rounded after mutation
+SEARCH_SPACE = {"target_distance_weight": (0.0, 4.0, 0.4),
+                "target_cyborg_weight": (0.0, 4.0, 0.4),
+                "reinforce_fraction": (0.0, 1.0, 0.15),
+                "reinforce_locality_factor": (0.5, 1.5, 0.1),
+                "bomb_rate_factor": (0.5, 2.0, 0.2),
+                "bomb_cyborg_factor": (0.5, 2.0, 0.2),
+                "search_depth": (1, 20, 3),
+                "search_rate_weight": (0.0, 40.0, 5.0),
+                "threat_weight": (0.0, 1.0, 0.1)}
+INTEGER_PARAMS = {"search_depth"}
+
+
+def params_hash(params):
+    return hashlib.sha1(bot.Params.from_dict(params).key().encode()).hexdigest()
+
+
+# Everything besides the parameters a fitness depends on: the match seeds, the map size, the opponent and the
+# code both sides run
+def match_context(seeds, num_factories, opponent):
+    sources = hashlib.sha1()
+    for module in (bot, referee):
+        with open(module.__file__, "rb") as f:
+            sources.update(f.read())
+    return {"seeds": list(seeds), "factories": num_factories, "opponent": bot.Params.from_dict(opponent).key(),
+            "sources": sources.hexdigest()}
+
+
+#################################################################################
+# Fitness results by parameter and match context hash, persisted so reruns and repeated children cost nothing
+class FitnessCache:
+    def __init__(self, path, context):
+        self.path = path
+        self.context = context
+        self.__context_key = json.dumps(context, sort_keys=True)
+        self.entries = {}   # hash -> {"params", "context", "games", "points"}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def __key(self, params):
+        return hashlib.sha1((params_hash(params) + self.__context_key).encode()).hexdigest()
+
+    def get(self, params, games):
+        entry = self.entries.get(self.__key(params))
+        if entry is None or entry["games"] < games:
+            return None
+        return entry["points"] / float(entry["games"])
+
+    def put(self, params, games, points):
+        self.entries[self.__key(params)] = {"params": params, "context": self.context, "games": games,
+                                            "points": points}
+
+    def save(self):
+        if self.path:
+            with open(self.path, "w") as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+
+
+def mutate(params, rand, rate=0.5):
+    child = dict(params)
+    for name, (low, high, sigma) in SEARCH_SPACE.items():
+        if rand.random() < rate:
+            value = min(high, max(low, child[name] + rand.gauss(0.0, sigma)))
+            child[name] = int(round(value)) if name in INTEGER_PARAMS else round(value, 3)
+    return child
+
+
+def crossover(first, second, rand):
+    return {name: (first if rand.random() < 0.5 else second)[name] for name in first}
+
+
+# One self-play game against the default parameters, 1 point per win and half per draw
+def _play_job(args):
+    params, seed, num_factories = args
+    result = referee.play_match(seed, swap=seed % 2 == 1, num_factories=num_factories,
+                                bot_params=(params, bot.Params().to_dict()))
+    if result["winner"] == -1:
+        return params_hash(params), 0.5
+    return params_hash(params), 1.0 if result["winner"] == 0 else 0.0
+
+
+# Fitness of every parameter set over the same seeds, only uncached sets are played
+def evaluate(population, seeds, cache, pool, num_factories=None):
+    pending = {params_hash(p): p for p in population if cache.get(p, len(seeds)) is None}
+    jobs = [(params, seed, num_factories) for params in pending.values() for seed in seeds]
+    points = dict.fromkeys(pending, 0.0)
+    for key, score in pool.imap_unordered(_play_job, jobs):
+        points[key] += score
+    for key, params in pending.items():
+        cache.put(params, len(seeds), points[key])
+    cache.save()
+    return [cache.get(p, len(seeds)) for p in population]
+
+
+def tune(generations, population_size, elite, seeds, workers=None, cache_path=CACHE_PATH, rand_seed=0,
+         num_factories=None):
+    rand = random.Random(rand_seed)
+    defaults = bot.Params().to_dict()
+    cache = FitnessCache(cache_path, match_context(seeds, num_factories, defaults))
+    population = [defaults] + [mutate(defaults, rand, rate=1.0) for _ in range(population_size - 1)]
+
+    with multiprocessing.Pool(workers or os.cpu_count()) as pool:
+        for generation in range(generations):
+            fitness = evaluate(population, seeds, cache, pool, num_factories)
+            ranked = sorted(zip(fitness, population), key=lambda x: -x[0])
+            print("generation {}: best {:.3f}, mean {:.3f}, {}".format(generation, ranked[0][0],
+                                                                       sum(fitness) / len(fitness), ranked[0][1]))
+            parents = [params for _, params in ranked[:elite]]
+            children = []
+            while len(parents) + len(children) < population_size:
+                first, second = rand.sample(parents, 2) if len(parents) > 1 else (parents[0], parents[0])
+                children.append(mutate(crossover(first, second, rand), rand))
+            population = parents + children
+
+        fitness = evaluate(population, seeds, cache, pool, num_factories)
+    return max(zip(fitness, population), key=lambda x: x[0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genetic tuning of the planner's Params through parallel self-play")
+    parser.add_argument("--generations", type=int, default=10)
+    parser.add_argument("--population", type=int, default=12)
+    parser.add_argument("--elite", type=int, default=4)
+    parser.add_argument("--games", type=int, default=40, help="games per parameter set")
+    parser.add_argument("--seed", type=int, default=0, help="first match seed, also seeds the mutations")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--factories", type=int, default=None)
+    parser.add_argument("--cache", default=CACHE_PATH)
+    parser.add_argument("--output", default=bot.PARAMS_PATH)
+    args = parser.parse_args()
+
+    seeds = list(range(args.seed, args.seed + args.games))
+    fitness, params = tune(args.generations, args.population, args.elite, seeds, args.workers, args.cache,
+                           args.seed, args.factories)
+    bot.Params.from_dict(params).save(args.output)
+    print("Best fitness {:.3f} vs defaults, saved to {}".format(fitness, args.output))
+
+
+if __name__ == "__main__":
+    main()